@@ -2,32 +2,129 @@ import streamlit as st
 from mcp import send_mcp_message, receive_mcp_message
 from ingestion_agent import process_document
 from retrieval_agent import store_embeddings, retrieve_chunks
-from llm_response_agent import generate_response
+from llm_response_agent import LLMStreamError, generate_response, get_model_info, run_async, iterate_async
 import os
-import json
+import orjson
 from datetime import datetime
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, filename="app.log", format="%(asctime)s - %(levelname)s - %(message)s")
 
-# File to store chat history
-HISTORY_FILE = "chat_history.json"
+# Maximum number of documents ingested concurrently
+MAX_UPLOAD_WORKERS = 8
 
-# Load chat history from file
-def load_chat_history():
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+# File to store chat history (newline-delimited JSON, append-only)
+HISTORY_FILE = "chat_history.jsonl"
 
-# Save chat history to file
-def save_chat_history(history):
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
+# History file written by earlier versions (one JSON list of sessions)
+LEGACY_HISTORY_FILE = "chat_history.json"
+
+# Read history records one line at a time
+def iter_history_records():
+    with open(HISTORY_FILE, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield orjson.loads(line)
+            except ValueError:
+                # Skip a partially written trailing line
+                continue
+
+# Load chat history from file, rebuilding sessions from their records
+# Returns an OrderedDict of session_id -> session, most recently active first
+# Cached across reruns; mtime is the cache key so any append invalidates it
+@st.cache_data(show_spinner=False)
+def load_chat_history(mtime):
+    if not os.path.exists(HISTORY_FILE):
+        return OrderedDict()
+    sessions = {}
+    try:
+        for record in iter_history_records():
+            session_id = record["session_id"]
+            session = sessions.pop(session_id, None) or {
+                "session_id": session_id,
+                "timestamp": record.get("timestamp", datetime.now().isoformat()),
+                "title": "New Chat",
+                "messages": []
+            }
+            if record["type"] == "session":
+                # Session metadata is last-write-wins
+                session.update({k: v for k, v in record.items() if k not in ("type", "messages")})
+            elif record["type"] == "message":
+                session["messages"].append(record["message"])
+            # Re-insert so the most recently active session ends up last
+            sessions[session_id] = session
+    except Exception as e:
+        logging.error(f"Error loading chat history: {str(e)}")
+        return OrderedDict()
+    return OrderedDict((session_id, sessions[session_id]) for session_id in reversed(sessions))
+
+# Modification time of the history file (0 if it does not exist yet)
+def history_mtime():
+    return os.path.getmtime(HISTORY_FILE) if os.path.exists(HISTORY_FILE) else 0
+
+# Format an ISO timestamp for the sidebar (cached across reruns)
+@st.cache_data(show_spinner=False)
+def format_timestamp(iso):
+    return datetime.fromisoformat(iso).strftime("%b %d, %H:%M")
+
+# Append records to the chat history file
+def save_chat_history(records):
+    with open(HISTORY_FILE, 'ab') as f:
+        f.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+
+# Remove all stored chat history
+def clear_chat_history():
+    open(HISTORY_FILE, 'wb').close()
+
+# Build history records for a session's metadata and for a single message
+def session_record(session):
+    return {
+        "type": "session",
+        "session_id": session["session_id"],
+        "timestamp": session["timestamp"],
+        "title": session["title"]
+    }
+
+def message_record(session, message):
+    return {"type": "message", "session_id": session["session_id"], "message": message}
+
+# Move a session to the front of the in-memory history
+def touch_session(history, session):
+    history[session["session_id"]] = session
+    history.move_to_end(session["session_id"], last=False)
+
+# Convert the legacy JSON history into session/message records (once)
+# The legacy list is most recent first, so sessions are written oldest first;
+# records already in the JSONL file are kept after them as the newer activity
+def migrate_legacy_history():
+    try:
+        with open(LEGACY_HISTORY_FILE, 'rb') as f:
+            legacy_sessions = orjson.loads(f.read())
+    except Exception as e:
+        logging.error(f"Could not read legacy chat history: {str(e)}")
+        return
+    
+    records = []
+    for session in reversed(legacy_sessions):
+        records.append(session_record(session))
+        records.extend(message_record(session, message) for message in session.get("messages", []))
+    
+    tmp_path = HISTORY_FILE + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+        if os.path.exists(HISTORY_FILE):
+            with open(HISTORY_FILE, 'rb') as existing:
+                f.write(existing.read())
+    os.replace(tmp_path, HISTORY_FILE)
+    os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + ".migrated")
+    logging.info(f"Migrated {len(legacy_sessions)} sessions from {LEGACY_HISTORY_FILE}")
 
 # Create a new chat session
 def create_new_session():
@@ -40,27 +137,37 @@ def create_new_session():
     }
 
 # Coordinator function to manage uploads
+# Uploads run concurrently, so each takes the message for its own document
 def coordinate_upload(file, filename):
     success = process_document(file, filename)
     if success:
-        message = receive_mcp_message("RetrievalAgent")
+        message = receive_mcp_message(
+            "RetrievalAgent",
+            match=lambda message: message["payload"]["document_name"] == filename
+        )
         if message:
-            store_embeddings(message["payload"]["chunks"], message["payload"]["document_name"])
+            success = store_embeddings(message["payload"]["chunks"], message["payload"]["document_name"])
         return success
     return False
 
 # Coordinator function to manage queries with model selection
-def coordinate_query(query, selected_model):
+# With stream=True the response is an iterator of answer fragments; meta["model"]
+# names the model that actually answered (it may be the fallback model)
+def coordinate_query(query, selected_model, stream=False):
     top_chunks = retrieve_chunks(query)
     message = receive_mcp_message("LLMResponseAgent")
     if message:
-        response, sources = generate_response(
+        # generate_response is async; run it on the LLM agent's event loop
+        response, sources, meta = run_async(generate_response(
             message["payload"]["query"], 
             message["payload"]["top_chunks"],
-            model_name=selected_model  # Pass the selected model
-        )
-        return response, sources
-    return None, None
+            model_name=selected_model,  # Pass the selected model
+            stream=stream
+        ))
+        if stream:
+            response = iterate_async(response)
+        return response, sources, meta
+    return None, None, None
 
 # Streamlit UI
 def main():
@@ -68,7 +175,9 @@ def main():
     
     # Initialize session state
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = load_chat_history()
+        if os.path.exists(LEGACY_HISTORY_FILE):
+            migrate_legacy_history()
+        st.session_state.chat_history = load_chat_history(history_mtime())
     
     if "current_session" not in st.session_state:
         st.session_state.current_session = create_new_session()
@@ -104,22 +213,16 @@ def main():
         
         # New Chat Button
         if st.button("➕ New Chat", use_container_width=True):
-            # Save current session before creating new one
+            # Messages are already persisted; only record the final title
             if st.session_state.messages:
                 st.session_state.current_session["messages"] = st.session_state.messages
                 # Update title based on first user message
-                if st.session_state.messages:
-                    first_msg = next((m for m in st.session_state.messages if m["role"] == "user"), None)
-                    if first_msg:
-                        st.session_state.current_session["title"] = first_msg["content"][:50] + "..."
+                first_msg = next((m for m in st.session_state.messages if m["role"] == "user"), None)
+                if first_msg:
+                    st.session_state.current_session["title"] = first_msg["content"][:50] + "..."
+                    save_chat_history([session_record(st.session_state.current_session)])
                 
-                # Add to history if not already there
-                existing = next((s for s in st.session_state.chat_history 
-                               if s["session_id"] == st.session_state.current_session["session_id"]), None)
-                if existing:
-                    st.session_state.chat_history.remove(existing)
-                st.session_state.chat_history.insert(0, st.session_state.current_session)
-                save_chat_history(st.session_state.chat_history)
+                touch_session(st.session_state.chat_history, st.session_state.current_session)
             
             # Create new session
             st.session_state.current_session = create_new_session()
@@ -129,8 +232,8 @@ def main():
         # Display chat history
         if st.session_state.chat_history:
             st.markdown("### Previous Chats")
-            for idx, session in enumerate(st.session_state.chat_history[:10]):  # Show last 10
-                timestamp = datetime.fromisoformat(session["timestamp"]).strftime("%b %d, %H:%M")
+            for idx, session in enumerate(islice(st.session_state.chat_history.values(), 10)):  # Show last 10
+                timestamp = format_timestamp(session["timestamp"])
                 if st.button(
                     f"💬 {session['title']}\n📅 {timestamp}",
                     key=f"history_{idx}",
@@ -145,8 +248,9 @@ def main():
         
         # Clear all history button
         if st.button("🗑️ Clear All History", use_container_width=True):
-            st.session_state.chat_history = []
-            save_chat_history([])
+            st.session_state.chat_history = OrderedDict()
+            clear_chat_history()
+            load_chat_history.clear()
             st.success("History cleared!")
             st.rerun()
     
@@ -165,12 +269,21 @@ def main():
     )
     
     if uploaded_files:
-        for file in uploaded_files:
-            with st.spinner(f"Processing {file.name}..."):
-                if coordinate_upload(file, file.name):
-                    st.success(f"✅ Successfully processed {file.name}")
-                else:
-                    st.error(f"❌ Failed to process {file.name}")
+        # Ingest files concurrently; report each one as soon as it finishes
+        with st.spinner(f"Processing {len(uploaded_files)} file(s)..."):
+            with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(uploaded_files))) as executor:
+                futures = {executor.submit(coordinate_upload, file, file.name): file for file in uploaded_files}
+                for future in as_completed(futures):
+                    file = futures[future]
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        logging.error(f"Error processing {file.name}: {str(e)}")
+                        success = False
+                    if success:
+                        st.success(f"✅ Successfully processed {file.name}")
+                    else:
+                        st.error(f"❌ Failed to process {file.name}")
     
     st.markdown("---")
     
@@ -181,16 +294,24 @@ def main():
             st.markdown(message["content"])
             if "sources" in message and message["sources"]:
                 with st.expander("📚 View Sources"):
-                    st.markdown("**Sources**: " + ", ".join(set(message["sources"])))
+                    st.markdown("**Sources**: " + ", ".join(message["sources"]))
     
     # Chat input
     if prompt := st.chat_input("💬 Ask a question about the documents"):
         # Add user message
-        st.session_state.messages.append({
+        user_message = {
             "role": "user",
             "content": prompt,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        st.session_state.messages.append(user_message)
+        st.session_state.current_session["messages"] = st.session_state.messages
+        
+        # Persist the user message (and the session header with its first message)
+        records = [message_record(st.session_state.current_session, user_message)]
+        if len(st.session_state.messages) == 1:
+            records.insert(0, session_record(st.session_state.current_session))
+        save_chat_history(records)
         
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -198,39 +319,46 @@ def main():
         # Generate response
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                response, sources = coordinate_query(prompt, selected_model)
+                response, sources, meta = coordinate_query(prompt, selected_model, stream=True)
+            
+            if response:
+                # Render tokens as they arrive; returns the full answer text.
+                # A failed stream is reported here and not saved to history.
+                try:
+                    response = st.write_stream(response)
+                except LLMStreamError as e:
+                    st.error(f"❌ {e}")
+                    return
+            
+            if response:
+                if sources:
+                    with st.expander("📚 View Sources"):
+                        st.markdown("**Sources**: " + ", ".join(sources))
+                
+                # Add assistant message
+                assistant_message = {
+                    "role": "assistant",
+                    "content": response,
+                    "sources": sources,
+                    "timestamp": datetime.now().isoformat(),
+                    "model": get_model_info(meta["model"])["name"]
+                }
+                st.session_state.messages.append(assistant_message)
+                
+                # Update current session
+                st.session_state.current_session["messages"] = st.session_state.messages
+                records = [message_record(st.session_state.current_session, assistant_message)]
+                
+                # Update title if first message
+                if len(st.session_state.messages) == 2:  # First Q&A pair
+                    st.session_state.current_session["title"] = prompt[:50] + ("..." if len(prompt) > 50 else "")
+                    records.append(session_record(st.session_state.current_session))
                 
-                if response:
-                    st.markdown(response)
-                    if sources:
-                        with st.expander("📚 View Sources"):
-                            st.markdown("**Sources**: " + ", ".join(set(sources)))
-                    
-                    # Add assistant message
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response,
-                        "sources": sources,
-                        "timestamp": datetime.now().isoformat(),
-                        "model": selected_model_name
-                    })
-                    
-                    # Update current session
-                    st.session_state.current_session["messages"] = st.session_state.messages
-                    
-                    # Update title if first message
-                    if len(st.session_state.messages) == 2:  # First Q&A pair
-                        st.session_state.current_session["title"] = prompt[:50] + ("..." if len(prompt) > 50 else "")
-                    
-                    # Save to history
-                    existing = next((s for s in st.session_state.chat_history 
-                                   if s["session_id"] == st.session_state.current_session["session_id"]), None)
-                    if existing:
-                        st.session_state.chat_history.remove(existing)
-                    st.session_state.chat_history.insert(0, st.session_state.current_session)
-                    save_chat_history(st.session_state.chat_history)
-                else:
-                    st.error("❌ No relevant information found.")
+                # Append to history
+                touch_session(st.session_state.chat_history, st.session_state.current_session)
+                save_chat_history(records)
+            else:
+                st.error("❌ No relevant information found.")
 
 if __name__ == "__main__":
     main()
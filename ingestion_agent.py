@@ -12,16 +12,46 @@ This agent handles:
 """
 
 import os
-import PyPDF2
+import io
+import csv
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import tiktoken
+import pypdfium2 as pdfium
 from docx import Document
 from pptx import Presentation
 import logging
-from mcp import send_mcp_message
+from mcp import MCPMessage, send_mcp_message
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Module logger; handlers and level are configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
+# Size of the text blocks streamed from TXT/MD/CSV files
+READ_BLOCK_SIZE = 64 * 1024
+
+# Chunking parameters (in tokens, matching LLM and embedding model budgets)
+CHUNK_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 40
+
+# Tokenizer used to measure chunk sizes
+_ENC = tiktoken.get_encoding("cl100k_base")
+
+# Content-hash cache of chunked documents (least recently used entries evicted)
+CHUNK_CACHE_DIR = os.path.join(".cache", "chunks")
+CHUNK_CACHE_MAX_BYTES = int(os.getenv("CHUNK_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Part of every cache key; bump whenever chunk_text output changes for the
+# same input (algorithm, tokenizer or boundary rules) so stale entries miss
+CHUNKER_VERSION = 3
+
+SUPPORTED_EXTENSIONS = {"pdf", "docx", "pptx", "txt", "md", "csv"}
+
+# PDFium is not thread-safe; uploads are ingested on a thread pool, so all
+# pypdfium2 calls (open, page iteration, close) are serialized
+_PDFIUM_LOCK = threading.Lock()
+
 
 def extract_text_from_pdf(file):
     """
@@ -34,10 +64,20 @@ def extract_text_from_pdf(file):
         str: Extracted text content
     """
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        # PDFium (native code) is much faster than pure-Python PDF parsers
+        source = file if isinstance(file, str) else file.read()
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(source)
+            try:
+                parts = []
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    parts.append(textpage.get_text_range() or "")
+                    textpage.close()
+                    page.close()
+            finally:
+                pdf.close()
+        text = "\n".join(parts)
         logger.info(f"Successfully extracted text from PDF ({len(text)} characters)")
         return text
     except Exception as e:
@@ -77,11 +117,12 @@ def extract_text_from_pptx(file):
     """
     try:
         prs = Presentation(file)
-        text = ""
+        parts = []
         for slide in prs.slides:
             for shape in slide.shapes:
                 if hasattr(shape, "text"):
-                    text += shape.text + "\n"
+                    parts.append(shape.text)
+        text = "\n".join(parts)
         logger.info(f"Successfully extracted text from PPTX ({len(text)} characters)")
         return text
     except Exception as e:
@@ -89,111 +130,356 @@ def extract_text_from_pptx(file):
         return ""
 
 
+@contextmanager
+def _open_text(file, newline=None):
+    """
+    Open a path or binary file object as a UTF-8 text stream.
+    
+    Args:
+        file: File object or path
+        newline: Newline handling passed to the text layer
+        
+    Yields:
+        TextIO: Text stream over the file
+    """
+    if isinstance(file, str):
+        with open(file, 'r', encoding='utf-8', newline=newline) as f:
+            yield f
+    else:
+        wrapper = io.TextIOWrapper(file, encoding='utf-8', newline=newline)
+        try:
+            yield wrapper
+        finally:
+            # Detach so the caller's file object is not closed with the wrapper
+            wrapper.detach()
+
+
 def extract_text_from_txt(file):
     """
-    Extract text content from plain text files.
+    Stream text content from plain text files.
     
     Args:
         file: File object or path to TXT/MD
         
-    Returns:
-        str: Extracted text content
+    Yields:
+        str: Blocks of extracted text (READ_BLOCK_SIZE characters each)
+        
+    Raises:
+        Exception: Read/decode errors are logged and re-raised so a partially
+            read file is never treated as a complete document
     """
+    total_chars = 0
     try:
-        if isinstance(file, str):
-            with open(file, 'r', encoding='utf-8') as f:
-                text = f.read()
-        else:
-            text = file.read().decode('utf-8')
-        logger.info(f"Successfully extracted text from TXT ({len(text)} characters)")
-        return text
+        with _open_text(file) as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), ""):
+                total_chars += len(block)
+                yield block
+        logger.info(f"Successfully extracted text from TXT ({total_chars} characters)")
     except Exception as e:
         logger.error(f"Error extracting text from TXT: {str(e)}")
-        return ""
+        raise
 
 
 def extract_text_from_csv(file):
     """
-    Extract text content from CSV files.
+    Stream text content from CSV files.
     
     Args:
         file: File object or path to CSV
         
-    Returns:
-        str: Extracted text content (formatted as rows)
+    Yields:
+        str: Blocks of extracted text (formatted as rows)
+        
+    Raises:
+        Exception: Read/decode errors are logged and re-raised so a partially
+            read file is never treated as a complete document
     """
+    total_chars = 0
     try:
-        import csv
-        import io
-        
-        if isinstance(file, str):
-            with open(file, 'r', encoding='utf-8') as f:
-                content = f.read()
-        else:
-            content = file.read().decode('utf-8')
-        
-        csv_reader = csv.reader(io.StringIO(content))
-        text = "\n".join([", ".join(row) for row in csv_reader])
-        logger.info(f"Successfully extracted text from CSV ({len(text)} characters)")
-        return text
+        with _open_text(file, newline='') as f:
+            rows = []
+            block_chars = 0
+            for row in csv.reader(f):
+                line = ", ".join(row)
+                rows.append(line)
+                block_chars += len(line) + 1
+                if block_chars >= READ_BLOCK_SIZE:
+                    block = "\n".join(rows) + "\n"
+                    total_chars += len(block)
+                    yield block
+                    rows = []
+                    block_chars = 0
+            if rows:
+                block = "\n".join(rows)
+                total_chars += len(block)
+                yield block
+        logger.info(f"Successfully extracted text from CSV ({total_chars} characters)")
     except Exception as e:
         logger.error(f"Error extracting text from CSV: {str(e)}")
-        return ""
+        raise
 
 
-def chunk_text(text, chunk_size=500, overlap=50):
+def _pretoken_start(text, limit):
     """
-    Split text into overlapping chunks for better context preservation.
+    Find the last offset at or before limit where tokenization can restart.
+    
+    A space that follows a non-whitespace character always opens a new
+    pre-token (cl100k_base never joins a space onto the preceding word,
+    number or punctuation), so the text before it tokenizes the same way
+    whatever follows, and re-encoding from it reproduces the same tokens.
     
     Args:
-        text (str): Input text to chunk
-        chunk_size (int): Size of each chunk in characters
-        overlap (int): Number of overlapping characters between chunks
+        text (str): Buffered text
+        limit (int): Character offset to search back from
         
     Returns:
-        list: List of text chunks
+        int: Character offset of the restart point (0 if there is none)
     """
-    if not text or len(text) == 0:
-        logger.warning("Empty text provided for chunking")
-        return []
+    pos = text.rfind(' ', 0, limit + 1)
+    while pos > 0 and text[pos - 1].isspace():
+        pos = text.rfind(' ', 0, pos)
+    return max(pos, 0)
+
+
+def _chunk_window(text, chunk_tokens, overlap_tokens, final, resume=0):
+    """
+    Chunk as much of a text buffer as can be decided without more input.
     
-    chunks = []
-    start = 0
-    text_length = len(text)
+    Unless final, text from the last pre-token boundary on is held back: the
+    trailing word and whitespace may tokenize differently once more text
+    arrives. The buffer is also only ever cut at a pre-token boundary, so
+    streamed text chunks exactly like the same text passed as one string.
+    
+    Args:
+        text (str): Buffered text
+        chunk_tokens (int): Size of each chunk in tokens
+        overlap_tokens (int): Number of overlapping tokens between chunks
+        final (bool): Whether no more text will follow this buffer
+        resume (int): Index of the token the next chunk starts at
+        
+    Returns:
+        tuple: (chunks: list, cut: int character offset the buffer can be
+                trimmed to, resume: int token index of the next chunk after the cut)
+    """
+    # Tokenize once; offsets[i] is the character where token i starts
+    tokens = _ENC.encode(text, disallowed_special=())
+    text, offsets = _ENC.decode_with_offsets(tokens)
+    token_count = len(tokens)
+    offsets = np.array(offsets + [len(text)], dtype=np.int64)
+    
+    # Tokens before the last pre-token boundary cannot change with more input
+    if final:
+        stable_count = token_count
+    else:
+        stable_count = int(np.searchsorted(offsets, _pretoken_start(text, len(text) - 1)))
+    
+    # Locate every sentence/word boundary ('.', '\n', ' ') in one pass.
+    # UTF-32 gives one code unit per character, so indices match str offsets.
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    boundaries = np.flatnonzero((codes == 46) | (codes == 10) | (codes == 32))
     
-    while start < text_length:
-        end = start + chunk_size
-        chunk = text[start:end]
+    chunks = []
+    start = resume
+    while start < token_count:
+        end = start + chunk_tokens
+        if not final and end > stable_count:
+            break  # Trailing tokens may still change once more text arrives
         
         # Try to break at sentence or word boundary
-        if end < text_length:
-            # Look for sentence end
-            last_period = chunk.rfind('.')
-            last_newline = chunk.rfind('\n')
-            last_space = chunk.rfind(' ')
-            
-            # Use the best boundary found
-            break_point = max(last_period, last_newline, last_space)
-            if break_point > chunk_size * 0.7:  # Only if boundary is reasonably close
-                chunk = chunk[:break_point + 1]
-                end = start + break_point + 1
+        if end < token_count:
+            # Use the last boundary inside the current window
+            pos = np.searchsorted(boundaries, offsets[end]) - 1
+            if pos >= 0 and boundaries[pos] >= offsets[start]:
+                boundary = boundaries[pos]
+                token = np.searchsorted(offsets, boundary, side='right') - 1
+                # Whitespace that opens a token (" word") belongs to the next chunk
+                break_point = token if offsets[token] == boundary and codes[boundary] != 46 else token + 1
+                if break_point - start > chunk_tokens * 0.7:  # Only if boundary is reasonably close
+                    end = break_point
+        else:
+            end = token_count
         
-        chunks.append(chunk.strip())
-        start = end - overlap  # Create overlap
+        chunks.append(text[offsets[start]:offsets[end]].strip())
+        if end >= token_count:
+            start = token_count
+            break
+        start = end - overlap_tokens  # Create overlap
+    
+    # Tokens are counted rather than located by character offset: byte-level
+    # tokens inside one multi-byte character all share its offset
+    cut = _pretoken_start(text, int(offsets[start]))
+    return chunks, cut, start - int(np.searchsorted(offsets, cut))
+
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split text into overlapping token-sized chunks for better context preservation.
+    
+    Text may be a single string or an iterable of string blocks; blocks are
+    consumed through a sliding buffer so only the unchunked tail is kept.
+    
+    Args:
+        text (str or iterable): Input text (or text blocks) to chunk
+        chunk_tokens (int): Size of each chunk in tokens (cl100k_base)
+        overlap_tokens (int): Number of overlapping tokens between chunks
+        
+    Returns:
+        list: List of unique, non-empty text chunks
+    """
+    pieces = [text] if isinstance(text, str) else text
+    
+    chunks = []
+    buffer = ""
+    resume = 0
+    for piece in pieces:
+        buffer += piece
+        window_chunks, cut, resume = _chunk_window(buffer, chunk_tokens, overlap_tokens, final=False, resume=resume)
+        chunks.extend(window_chunks)
+        buffer = buffer[cut:]
+    
+    window_chunks, _, _ = _chunk_window(buffer, chunk_tokens, overlap_tokens, final=True, resume=resume)
+    chunks.extend(window_chunks)
+    
+    # Drop whitespace-only chunks and repeated content (e.g. slide footers)
+    chunk_count = len(chunks)
+    chunks = list(dict.fromkeys(chunk for chunk in chunks if chunk))
+    if len(chunks) < chunk_count:
+        logger.info(f"Dropped {chunk_count - len(chunks)} empty or duplicate chunks")
+    
+    if not chunks:
+        logger.warning("Empty text provided for chunking")
+        return []
     
     logger.info(f"Text chunked into {len(chunks)} segments")
     return chunks
 
 
+def _count_chars(pieces, totals):
+    """
+    Pass text blocks through while counting their characters.
+    
+    Args:
+        pieces (iterable): Text blocks
+        totals (dict): Counter updated in place under "total_chars"
+        
+    Yields:
+        str: The unchanged text blocks
+    """
+    for piece in pieces:
+        totals["total_chars"] += len(piece)
+        yield piece
+
+
+def compute_cache_key(file, file_extension):
+    """
+    Compute the chunk cache key from the file content.
+    
+    The key covers the file type, chunker version and chunking parameters as
+    well as the SHA-256 of the content, so the same bytes uploaded under
+    another format or chunked differently never collide.
+    
+    Args:
+        file: File object or path
+        file_extension (str): Lower-cased file extension
+        
+    Returns:
+        str: Hex digest, or None if the file could not be hashed
+    """
+    try:
+        digest = hashlib.sha256(f"{file_extension}:{CHUNKER_VERSION}:{CHUNK_TOKENS}:{CHUNK_OVERLAP_TOKENS}:".encode('utf-8'))
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                    digest.update(block)
+        else:
+            for block in iter(lambda: file.read(READ_BLOCK_SIZE), b""):
+                digest.update(block)
+            file.seek(0)
+        return digest.hexdigest()
+    except Exception as e:
+        logger.warning(f"Could not hash document for caching: {str(e)}")
+        return None
+
+
+def load_cached_chunks(cache_key):
+    """
+    Load previously chunked content from the cache.
+    
+    Args:
+        cache_key (str): Key from compute_cache_key
+        
+    Returns:
+        dict: {"chunks": list, "total_chars": int} or None on cache miss
+    """
+    path = os.path.join(CHUNK_CACHE_DIR, f"{cache_key}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        os.utime(path)  # Mark as recently used
+        return data
+    except Exception as e:
+        logger.warning(f"Could not read chunk cache entry: {str(e)}")
+        return None
+
+
+def save_cached_chunks(cache_key, chunks, total_chars):
+    """
+    Write chunked content to the cache and evict old entries.
+    
+    Args:
+        cache_key (str): Key from compute_cache_key
+        chunks (list): Text chunks
+        total_chars (int): Number of extracted characters
+    """
+    try:
+        os.makedirs(CHUNK_CACHE_DIR, exist_ok=True)
+        path = os.path.join(CHUNK_CACHE_DIR, f"{cache_key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"chunks": chunks, "total_chars": total_chars}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        evict_chunk_cache()
+    except Exception as e:
+        logger.warning(f"Could not write chunk cache entry: {str(e)}")
+
+
+def evict_chunk_cache(max_bytes=None):
+    """
+    Remove least recently used cache entries until the cache fits in max_bytes.
+    
+    Args:
+        max_bytes (int): Size limit (default: CHUNK_CACHE_MAX_BYTES)
+    """
+    if max_bytes is None:
+        max_bytes = CHUNK_CACHE_MAX_BYTES
+    
+    entries = []
+    for name in os.listdir(CHUNK_CACHE_DIR):
+        path = os.path.join(CHUNK_CACHE_DIR, name)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        logger.info(f"Evicted chunk cache entry: {os.path.basename(path)}")
+
+
 def process_document(file, filename):
     """
     Main processing function - coordinates document ingestion pipeline.
     
     Pipeline Steps:
     1. Identify file type
-    2. Extract text using appropriate extractor
-    3. Chunk text into segments
-    4. Send to Retrieval Agent via MCP
+    2. Reuse cached chunks if this exact content was processed before
+    3. Extract text using appropriate extractor
+    4. Chunk text into segments and cache them
+    5. Send to Retrieval Agent via MCP
     
     Args:
         file: File object to process
@@ -204,30 +490,50 @@ def process_document(file, filename):
     """
     logger.info(f"Starting document processing: {filename}")
     
-    # Determine file type and extract text
+    # Determine file type
     file_extension = filename.lower().split('.')[-1]
-    
-    text = ""
-    if file_extension == "pdf":
-        text = extract_text_from_pdf(file)
-    elif file_extension == "docx":
-        text = extract_text_from_docx(file)
-    elif file_extension == "pptx":
-        text = extract_text_from_pptx(file)
-    elif file_extension in ["txt", "md"]:
-        text = extract_text_from_txt(file)
-    elif file_extension == "csv":
-        text = extract_text_from_csv(file)
-    else:
+    if file_extension not in SUPPORTED_EXTENSIONS:
         logger.error(f"Unsupported file type: {file_extension}")
         return False
     
-    if not text:
-        logger.error(f"No text extracted from {filename}")
-        return False
+    # Skip extraction entirely for content we have already chunked
+    cache_key = compute_cache_key(file, file_extension)
+    cached = load_cached_chunks(cache_key) if cache_key else None
     
-    # Chunk the text
-    chunks = chunk_text(text, chunk_size=500, overlap=50)
+    if cached:
+        logger.info(f"Chunk cache hit for {filename}")
+        chunks = cached["chunks"]
+        totals = {"total_chars": cached["total_chars"]}
+    else:
+        # Extract text
+        text = ""
+        if file_extension == "pdf":
+            text = extract_text_from_pdf(file)
+        elif file_extension == "docx":
+            text = extract_text_from_docx(file)
+        elif file_extension == "pptx":
+            text = extract_text_from_pptx(file)
+        elif file_extension in ["txt", "md"]:
+            text = extract_text_from_txt(file)
+        elif file_extension == "csv":
+            text = extract_text_from_csv(file)
+        
+        if isinstance(text, str) and not text:
+            logger.error(f"No text extracted from {filename}")
+            return False
+        
+        # Chunk the text (TXT/MD/CSV are streamed block by block; a read
+        # error part-way through fails the document instead of truncating it)
+        totals = {"total_chars": 0}
+        try:
+            chunks = chunk_text(_count_chars([text] if isinstance(text, str) else text, totals),
+                                chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {str(e)}")
+            return False
+        
+        if chunks and cache_key:
+            save_cached_chunks(cache_key, chunks, totals["total_chars"])
     
     if not chunks:
         logger.error(f"No chunks created from {filename}")
@@ -235,25 +541,51 @@ def process_document(file, filename):
     
     # Send to Retrieval Agent via MCP
     logger.info(f"Sending {len(chunks)} chunks to Retrieval Agent via MCP")
-    message = {
-        "sender": "IngestionAgent",
-        "receiver": "RetrievalAgent",
-        "payload": {
+    message = MCPMessage(
+        sender="IngestionAgent",
+        receiver="RetrievalAgent",
+        payload={
             "chunks": chunks,
             "document_name": filename,
             "metadata": {
                 "file_type": file_extension,
                 "chunk_count": len(chunks),
-                "total_chars": len(text)
+                "total_chars": totals["total_chars"]
             }
         }
-    }
+    )
     
     send_mcp_message(message)
     logger.info(f"Successfully processed document: {filename}")
     return True
 
 
+def test_chunking():
+    """
+    Check that short documents and document tails are chunked, whether the
+    text arrives as one string or as streamed blocks.
+    """
+    print("\nChunking checks:")
+    
+    # A document shorter than one chunk becomes exactly one chunk
+    short = "Retrieval-augmented generation grounds answers in documents. " * 3
+    for label, source in (("whole", short), ("streamed", iter([short[:97], short[97:]]))):
+        chunks = chunk_text(source)
+        assert chunks == [short.strip()], f"short document ({label}) gave {len(chunks)} chunks"
+    print("  ✓ Short document yields a single chunk")
+    
+    # The final window of a long document is kept
+    words = [f"word{i}" for i in range(3000)]
+    text = " ".join(words) + "."
+    blocks = [text[i:i + 1000] for i in range(0, len(text), 1000)]
+    for label, source in (("whole", text), ("streamed", iter(blocks))):
+        chunks = chunk_text(source)
+        assert chunks[0].startswith("word0 "), f"first chunk ({label}) lost the head"
+        assert chunks[-1].endswith(f"{words[-1]}."), f"last chunk ({label}) lost the tail"
+    assert chunk_text(text) == chunk_text(iter(blocks)), "streamed and whole-string chunks differ"
+    print("  ✓ Head and tail covered; streamed chunks match whole-string chunks")
+
+
 if __name__ == "__main__":
     # Test the ingestion agent
     print("=" * 60)
@@ -266,4 +598,5 @@ if __name__ == "__main__":
     print("  ✓ Intelligent text chunking with overlap")
     print("  ✓ Sentence-boundary aware splitting")
     print("  ✓ MCP communication for agent coordination")
+    test_chunking()
     print("=" * 60)
@@ -8,18 +8,26 @@ This agent handles:
 3. Generating responses using Groq LLM (multiple models supported)
 4. Tracking sources and model usage
 5. Error handling and fallback responses
+6. Semantic caching of answers for near-duplicate questions
 
 
 """
 
 from langchain_groq import ChatGroq
 import os
+import json
+import hashlib
+import functools
+import asyncio
+import threading
+from collections import deque
+import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
 import logging
+from retrieval_agent import embed_query, EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Module logger; handlers and level are configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
 # Load environment variables - FIX: Specify exact path to .env
@@ -40,6 +48,53 @@ if not GROQ_API_KEY:
 # Cache LLM instances to avoid reinitializing
 _llm_cache = {}
 
+# Fallback ladder: a timed-out or rate-limited request is retried on the fast model
+LLM_TIMEOUT_SECONDS = 30
+FALLBACK_MODEL = "llama-3.1-8b-instant"
+
+# Dedicated event loop for async LLM calls. The async Groq client keeps
+# connections bound to the loop it first ran on, so all calls share this one.
+_event_loop = asyncio.new_event_loop()
+threading.Thread(target=_event_loop.run_forever, name="llm-event-loop", daemon=True).start()
+
+# Default system instruction for RAG answers
+_SYSTEM_INSTRUCTION = """You are an AI assistant for a Retrieval-Augmented Generation (RAG) chatbot. Your task is to answer user questions using only the information provided in the context.
+
+Guidelines:
+- Only use information from the provided context
+- Do not add external knowledge or make assumptions
+- If the context is insufficient, acknowledge it clearly
+- Provide accurate, clear, and detailed responses
+- Cite specific parts of the context when relevant
+- Be concise but comprehensive
+- Use a professional and helpful tone"""
+
+# Semantic response cache: near-duplicate questions over the same retrieved
+# context reuse the previous answer instead of calling the Groq API again
+RESPONSE_CACHE_FILE = "response_cache.jsonl"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# Oldest answers are evicted past this many entries; the JSONL file is
+# compacted back down once it holds twice as many lines
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+
+# Embeddings live in a preallocated ring buffer (slot i pairs with entries[i]);
+# "next" is the slot to overwrite once the cache is full. _cache_lock guards
+# every read and write so lookups from worker threads see a consistent pair.
+_semantic_cache = {
+    "embs": np.zeros((RESPONSE_CACHE_MAX_ENTRIES, EMBEDDING_DIMENSION), dtype=np.float32),
+    "entries": [],
+    "next": 0,
+    "file_lines": 0
+}
+_cache_lock = threading.Lock()
+
+class LLMStreamError(Exception):
+    """
+    Raised from a streamed answer when the LLM call fails; the message is
+    the user-facing text from describe_llm_error.
+    """
+
+
 # Available Groq models
 AVAILABLE_MODELS = {
     "llama-3.3-70b-versatile": {
@@ -93,6 +148,247 @@ def get_llm(model_name="llama-3.3-70b-versatile", temperature=0.7):
     return _llm_cache[cache_key]
 
 
+def warm_llm_cache(temperature=0.7):
+    """
+    Create LLM instances for all available models ahead of the first query.
+    
+    A model that fails to initialize is logged and skipped; get_llm will
+    retry (and surface the error) when that model is actually requested.
+    
+    Args:
+        temperature (float): Sampling temperature to warm the cache for
+    """
+    for model_name in AVAILABLE_MODELS:
+        try:
+            get_llm(model_name, temperature)
+        except Exception:
+            logger.warning(f"Skipping warm-up for model {model_name}")
+
+
+def _chunks_signature(top_chunks):
+    """
+    Hash the retrieved chunks so cached answers are only reused for the same context.
+    
+    Args:
+        top_chunks (list): List of tuples (chunk_text, document_name)
+        
+    Returns:
+        str: SHA-256 hex digest of the chunks
+    """
+    digest = hashlib.sha256()
+    for chunk, doc_name in top_chunks:
+        digest.update(doc_name.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(chunk.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _normalize(vectors):
+    """
+    L2-normalize embeddings row-wise so dot products are cosine similarities.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def _add_cache_entry(embedding, entry):
+    """
+    Add a normalized embedding and its cached response to the in-memory store,
+    evicting the oldest entry once RESPONSE_CACHE_MAX_ENTRIES is reached.
+    
+    Must be called with _cache_lock held.
+    """
+    entries = _semantic_cache["entries"]
+    if len(entries) < RESPONSE_CACHE_MAX_ENTRIES:
+        slot = len(entries)
+        entries.append(entry)
+    else:
+        slot = _semantic_cache["next"]
+        entries[slot] = entry
+        _semantic_cache["next"] = (slot + 1) % RESPONSE_CACHE_MAX_ENTRIES
+    _semantic_cache["embs"][slot] = embedding
+
+
+def _cache_records():
+    """
+    Return the cached entries (with embeddings) from oldest to newest.
+    
+    Must be called with _cache_lock held.
+    """
+    entries = _semantic_cache["entries"]
+    start = _semantic_cache["next"]
+    order = list(range(start, len(entries))) + list(range(start))
+    return [dict(entries[i], embedding=_semantic_cache["embs"][i].tolist()) for i in order]
+
+
+def _compact_response_cache():
+    """
+    Rewrite the cache file with only the entries still held in memory.
+    
+    Must be called with _cache_lock held.
+    """
+    temp_file = RESPONSE_CACHE_FILE + ".tmp"
+    records = _cache_records()
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(temp_file, RESPONSE_CACHE_FILE)
+    _semantic_cache["file_lines"] = len(records)
+    logger.info(f"Compacted response cache to {len(records)} entries")
+
+
+def load_response_cache():
+    """
+    Load the persisted semantic cache from the append-only JSONL file.
+    
+    Only the newest RESPONSE_CACHE_MAX_ENTRIES records are kept. Malformed
+    records and records embedded by another backend or model are dropped
+    (and the file is rewritten without them); this runs at import, so a bad
+    line must never stop the app from starting.
+    """
+    if not os.path.exists(RESPONSE_CACHE_FILE):
+        return
+    
+    records = deque(maxlen=RESPONSE_CACHE_MAX_ENTRIES)
+    file_lines = 0
+    stale = 0
+    invalid = 0
+    try:
+        with open(RESPONSE_CACHE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                file_lines += 1
+                try:
+                    record = json.loads(line)
+                    embedding = np.asarray(record.pop("embedding"), dtype=np.float32)
+                    if embedding.shape != (EMBEDDING_DIMENSION,):
+                        raise ValueError(f"embedding has shape {embedding.shape}")
+                    if not all(key in record for key in ("query", "answer", "sources", "top_chunks_hash")):
+                        raise KeyError("missing cache entry fields")
+                except Exception:
+                    # Skip partially written or malformed records
+                    invalid += 1
+                    continue
+                if (record.get("embedding_backend"), record.get("embedding_model")) != (EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME):
+                    stale += 1
+                    continue
+                records.append((record, embedding))
+    except Exception as e:
+        logger.warning(f"Could not load response cache: {str(e)}")
+        return
+    
+    with _cache_lock:
+        if records:
+            _semantic_cache["embs"][:len(records)] = _normalize(np.stack([embedding for _, embedding in records]))
+            _semantic_cache["entries"] = [record for record, _ in records]
+            _semantic_cache["next"] = 0
+        _semantic_cache["file_lines"] = file_lines
+        if stale or invalid:
+            logger.warning(f"Dropped {invalid} malformed cached responses and {stale} embedded with another model")
+            try:
+                _compact_response_cache()
+            except Exception as e:
+                logger.warning(f"Could not rewrite response cache: {str(e)}")
+    logger.info(f"Loaded {len(records)} cached responses")
+
+
+def lookup_cached_response(query, top_chunks, model_name, temperature):
+    """
+    Find a cached answer for a semantically equivalent query over the same
+    context, generated by the same model at the same temperature.
+    
+    Args:
+        query (str): User's question
+        top_chunks (list): List of tuples (chunk_text, document_name)
+        model_name (str): Groq model identifier
+        temperature (float): Sampling temperature
+        
+    Returns:
+        tuple: (query_embedding, cached_entry or None)
+    """
+    query_embedding = embed_query(query)
+    if query_embedding is None:
+        return None, None
+    query_embedding = _normalize(query_embedding)[0]
+    
+    with _cache_lock:
+        count = len(_semantic_cache["entries"])
+        if not count:
+            return query_embedding, None
+        
+        sims = _semantic_cache["embs"][:count] @ query_embedding
+        candidates = np.flatnonzero(sims >= SEMANTIC_CACHE_THRESHOLD)
+        if not len(candidates):
+            return query_embedding, None
+        
+        chunks_hash = _chunks_signature(top_chunks)
+        for index in candidates[np.argsort(-sims[candidates])]:
+            entry = _semantic_cache["entries"][index]
+            if (entry["top_chunks_hash"] == chunks_hash
+                    and entry.get("model") == model_name
+                    and entry.get("temperature") == temperature):
+                logger.info(f"Semantic cache hit (similarity={sims[index]:.4f})")
+                return query_embedding, entry
+    
+    return query_embedding, None
+
+
+def store_cached_response(query_embedding, query, top_chunks, answer, sources, model_name, temperature):
+    """
+    Add a generated answer to the semantic cache and append it to disk.
+    
+    Args:
+        query_embedding (np.ndarray): Normalized query embedding
+        query (str): User's question
+        top_chunks (list): List of tuples (chunk_text, document_name)
+        answer (str): Generated answer
+        sources (list): Source document names
+        model_name (str): Groq model that generated the answer
+        temperature (float): Sampling temperature
+    """
+    entry = {
+        "query": query,
+        "answer": answer,
+        "sources": sources,
+        "top_chunks_hash": _chunks_signature(top_chunks),
+        "model": model_name,
+        "temperature": temperature,
+        "embedding_backend": EMBEDDING_BACKEND,
+        "embedding_model": EMBEDDING_MODEL_NAME
+    }
+    
+    with _cache_lock:
+        _add_cache_entry(query_embedding, entry)
+        try:
+            if _semantic_cache["file_lines"] >= 2 * RESPONSE_CACHE_MAX_ENTRIES:
+                _compact_response_cache()
+            else:
+                record = dict(entry, embedding=query_embedding.tolist())
+                with open(RESPONSE_CACHE_FILE, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                _semantic_cache["file_lines"] += 1
+        except Exception as e:
+            logger.warning(f"Could not persist response cache entry: {str(e)}")
+
+
+@functools.lru_cache(maxsize=512)
+def _build_context(chunks_tuple):
+    """
+    Join retrieved chunks into the prompt context (memoized per chunk set).
+    
+    Args:
+        chunks_tuple (tuple): Tuple of (chunk_text, document_name) tuples
+        
+    Returns:
+        str: Context with source labels
+    """
+    return "\n\n".join([f"[Source: {doc_name}]\n{chunk}" for chunk, doc_name in chunks_tuple])
+
+
 def construct_prompt(query, context, system_instruction=None):
     """
     Construct a well-formatted prompt for the LLM.
@@ -106,16 +402,7 @@ def construct_prompt(query, context, system_instruction=None):
         str: Formatted prompt
     """
     if system_instruction is None:
-        system_instruction = """You are an AI assistant for a Retrieval-Augmented Generation (RAG) chatbot. Your task is to answer user questions using only the information provided in the context.
-
-Guidelines:
-- Only use information from the provided context
-- Do not add external knowledge or make assumptions
-- If the context is insufficient, acknowledge it clearly
-- Provide accurate, clear, and detailed responses
-- Cite specific parts of the context when relevant
-- Be concise but comprehensive
-- Use a professional and helpful tone"""
+        system_instruction = _SYSTEM_INSTRUCTION
     
     prompt = f"""{system_instruction}
 
@@ -129,25 +416,265 @@ Answer:"""
     return prompt
 
 
-def generate_response(query, top_chunks, model_name="llama-3.3-70b-versatile", temperature=0.7):
+def run_async(coro):
+    """
+    Run a coroutine on the LLM event loop and wait for its result.
+    
+    Args:
+        coro: Coroutine to run
+        
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop).result()
+
+
+def iterate_async(agen):
+    """
+    Iterate an async generator from synchronous code (e.g. st.write_stream).
+    
+    The async generator is closed when iteration stops early, e.g. when
+    Streamlit abandons the stream on a rerun, so its HTTP stream is released
+    right away instead of at garbage collection.
+    
+    Args:
+        agen: Async generator running on the LLM event loop
+        
+    Yields:
+        Items produced by the async generator
+    """
+    try:
+        while True:
+            try:
+                yield run_async(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(agen.aclose())
+
+
+def describe_llm_error(model_name, error):
+    """
+    Log a Groq API error and turn it into a user-facing message.
+    
+    Args:
+        model_name (str): Groq model identifier
+        error (Exception): Error raised by the LLM call
+        
+    Returns:
+        str: Helpful error message
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        logger.error(f"Groq API call with model {model_name} timed out after {LLM_TIMEOUT_SECONDS}s")
+        return "Error: The language model took too long to respond. Please try again."
+    
+    error_msg = str(error)
+    logger.error(f"Error calling Groq API with model {model_name}: {error_msg}")
+    
+    # Provide helpful error messages
+    if "rate_limit" in error_msg.lower():
+        return "Error: Rate limit exceeded. Please wait a moment and try again."
+    elif "context_length" in error_msg.lower():
+        return "Error: Context too long. Try uploading smaller documents or asking a more specific question."
+    elif "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
+        return "Error: Authentication failed. Please check your Groq API key in the .env file."
+    else:
+        return f"Error generating response: {error_msg}"
+
+
+def should_fall_back(model_name, error):
+    """
+    Decide whether a failed call should be retried on FALLBACK_MODEL.
+    
+    Args:
+        model_name (str): Model that failed
+        error (Exception): Error raised by the LLM call
+        
+    Returns:
+        bool: True for timeouts and rate limits on a non-fallback model
+    """
+    if model_name == FALLBACK_MODEL:
+        return False
+    if isinstance(error, asyncio.TimeoutError) or "rate_limit" in str(error).lower():
+        logger.warning(f"Model {model_name} unavailable ({type(error).__name__}), falling back to {FALLBACK_MODEL}")
+        return True
+    return False
+
+
+async def invoke_with_fallback(prompt, model_name, temperature):
+    """
+    Generate a full answer, falling back to FALLBACK_MODEL on timeout or rate limit.
+    
+    Args:
+        prompt (str): Formatted prompt
+        model_name (str): Groq model identifier
+        temperature (float): Sampling temperature
+        
+    Returns:
+        tuple: (answer: str, model_used: str)
+    """
+    try:
+        response = await asyncio.wait_for(get_llm(model_name, temperature).ainvoke(prompt), timeout=LLM_TIMEOUT_SECONDS)
+        return response.content.strip(), model_name
+    except Exception as e:
+        if not should_fall_back(model_name, e):
+            raise
+    
+    response = await asyncio.wait_for(get_llm(FALLBACK_MODEL, temperature).ainvoke(prompt), timeout=LLM_TIMEOUT_SECONDS)
+    return response.content.strip(), FALLBACK_MODEL
+
+
+async def _next_chunk(stream):
+    """
+    Wait (bounded by LLM_TIMEOUT_SECONDS) for the next chunk of a stream.
+    
+    Raises:
+        StopAsyncIteration: When the stream is exhausted
+        asyncio.TimeoutError: When the model stalls
+    """
+    return await asyncio.wait_for(stream.__anext__(), timeout=LLM_TIMEOUT_SECONDS)
+
+
+async def _open_stream(prompt, model_name, temperature):
+    """
+    Start streaming from a model and wait (bounded) for its first chunk.
+    
+    A stream that fails before its first chunk is closed before the error
+    is re-raised, so an abandoned request does not keep its connection open.
+    
+    Returns:
+        tuple: (stream, first_chunk or None if the stream was empty)
+    """
+    stream = get_llm(model_name, temperature).astream(prompt)
+    try:
+        first = await _next_chunk(stream)
+    except StopAsyncIteration:
+        first = None
+    except Exception:
+        await stream.aclose()
+        raise
+    return stream, first
+
+
+async def astream_with_fallback(prompt, model_name, temperature, meta):
+    """
+    Stream answer fragments, falling back to FALLBACK_MODEL if the selected
+    model times out or is rate limited before producing its first token.
+    
+    Every chunk wait is bounded by LLM_TIMEOUT_SECONDS; a stall mid-answer
+    raises asyncio.TimeoutError and the stream is closed.
+    
+    Args:
+        prompt (str): Formatted prompt
+        model_name (str): Groq model identifier
+        temperature (float): Sampling temperature
+        meta (dict): Receives the model that is answering under "model"
+        
+    Yields:
+        str: Answer text fragments
+    """
+    try:
+        stream, first = await _open_stream(prompt, model_name, temperature)
+        meta["model"] = model_name
+    except Exception as e:
+        if not should_fall_back(model_name, e):
+            raise
+        stream, first = await _open_stream(prompt, FALLBACK_MODEL, temperature)
+        meta["model"] = FALLBACK_MODEL
+    
+    try:
+        if first is None:
+            return
+        if first.content:
+            yield first.content
+        while True:
+            try:
+                chunk = await _next_chunk(stream)
+            except StopAsyncIteration:
+                return
+            if chunk.content:
+                yield chunk.content
+    finally:
+        await stream.aclose()
+
+
+async def stream_answer(prompt, model_name, temperature, query, query_embedding, top_chunks, sources, meta):
+    """
+    Stream answer tokens from the LLM as they are generated.
+    
+    The complete answer is added to the semantic cache once the stream ends.
+    A failed call raises LLMStreamError instead of yielding the error text,
+    so callers can report it without treating it as part of the answer.
+    
+    Args:
+        prompt (str): Formatted prompt
+        model_name (str): Groq model identifier
+        temperature (float): Sampling temperature
+        query (str): User's question
+        query_embedding (np.ndarray): Normalized query embedding (or None)
+        top_chunks (list): List of tuples (chunk_text, document_name)
+        sources (list): Source document names
+        meta (dict): Receives the model that answered under "model"
+        
+    Yields:
+        str: Answer text fragments
+        
+    Raises:
+        LLMStreamError: If the LLM call fails (possibly after partial output)
+    """
+    parts = []
+    stream = astream_with_fallback(prompt, model_name, temperature, meta)
+    try:
+        async for content in stream:
+            parts.append(content)
+            yield content
+    except Exception as e:
+        raise LLMStreamError(describe_llm_error(meta["model"], e)) from e
+    finally:
+        # Also runs when this generator is closed early, closing the LLM stream
+        await stream.aclose()
+    
+    answer = "".join(parts).strip()
+    logger.info(f"Response streamed successfully ({len(answer)} characters)")
+    logger.info(f"Model used: {AVAILABLE_MODELS[meta['model']]['name']}")
+    
+    if query_embedding is not None:
+        store_cached_response(query_embedding, query, top_chunks, answer, sources, meta["model"], temperature)
+
+
+async def _single_fragment(answer):
+    """
+    Wrap a complete answer as a one-item async stream.
+    """
+    yield answer
+
+
+async def generate_response(query, top_chunks, model_name="llama-3.3-70b-versatile", temperature=0.7, stream=False):
     """
     Generate a response using the specified model.
     
     Pipeline:
     1. Extract context from retrieved chunks
-    2. Construct prompt with context and query
-    3. Call LLM to generate response
-    4. Extract sources from chunks
-    5. Return answer and sources
+    2. Return a cached answer for a near-duplicate query (semantic cache)
+    3. Construct prompt with context and query
+    4. Call (or stream from) LLM, falling back to FALLBACK_MODEL on timeout/rate limit
+    5. Extract sources from chunks and cache the answer
+    6. Return answer, sources and the model that answered
+    
+    This is a coroutine; synchronous callers run it with run_async() and
+    consume a streamed answer with iterate_async().
     
     Args:
         query (str): User's question
         top_chunks (list): List of tuples (chunk_text, document_name)
         model_name (str): Groq model identifier
         temperature (float): Sampling temperature
+        stream (bool): Return an async iterator of answer fragments instead of a string
         
     Returns:
-        tuple: (answer: str, sources: list)
+        tuple: (answer: str or async iterator of str when streaming, sources: list,
+                meta: dict whose "model" is the model that answered; for a streamed
+                answer it is updated once the stream has started)
     """
     logger.info(f"Generating response with model: {model_name}")
     logger.info(f"Query: {query[:100]}...")
@@ -157,13 +684,23 @@ def generate_response(query, top_chunks, model_name="llama-3.3-70b-versatile", t
     if model_name not in AVAILABLE_MODELS:
         logger.warning(f"Unknown model {model_name}, falling back to default")
         model_name = "llama-3.3-70b-versatile"
+    meta = {"model": model_name}
+    
+    def result(answer, sources):
+        return (_single_fragment(answer) if stream else answer), sources, meta
     
     # Extract context from chunks
     if not top_chunks:
         logger.warning("No context chunks provided")
-        return "I couldn't find any relevant information in the uploaded documents to answer your question. Please upload documents first.", []
+        return result("I couldn't find any relevant information in the uploaded documents to answer your question. Please upload documents first.", [])
+    
+    # Reuse the answer of a near-duplicate question over the same context
+    # (embedding the query is CPU work, so keep it off the event loop)
+    query_embedding, cached = await asyncio.to_thread(lookup_cached_response, query, top_chunks, model_name, temperature)
+    if cached is not None:
+        return result(cached["answer"], cached["sources"])
     
-    context = "\n\n".join([f"[Source: {doc_name}]\n{chunk}" for chunk, doc_name in top_chunks])
+    context = _build_context(tuple(top_chunks))
     
     # Construct prompt
     prompt = construct_prompt(query, context)
@@ -173,38 +710,33 @@ def generate_response(query, top_chunks, model_name="llama-3.3-70b-versatile", t
     
     # Get LLM instance
     try:
-        llm = get_llm(model_name, temperature)
+        get_llm(model_name, temperature)
     except Exception as e:
         logger.error(f"Failed to get LLM instance: {str(e)}")
-        return f"Error: Unable to initialize language model. Please check your API key and try again.", []
+        return result(f"Error: Unable to initialize language model. Please check your API key and try again.", [])
+    
+    # Extract unique sources (in retrieval rank order)
+    sources = list(dict.fromkeys(doc_name for _, doc_name in top_chunks))
+    logger.info(f"Sources: {', '.join(sources)}")
+    
+    # Stream tokens as they arrive; sources are known before the first token
+    if stream:
+        return stream_answer(prompt, model_name, temperature, query, query_embedding, top_chunks, sources, meta), sources, meta
     
     # Generate response
     try:
-        response = llm.invoke(prompt)
-        answer = response.content.strip()
+        answer, meta["model"] = await invoke_with_fallback(prompt, model_name, temperature)
         
         logger.info(f"Response generated successfully ({len(answer)} characters)")
-        logger.info(f"Model used: {AVAILABLE_MODELS[model_name]['name']}")
+        logger.info(f"Model used: {AVAILABLE_MODELS[meta['model']]['name']}")
         
     except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Error calling Groq API with model {model_name}: {error_msg}")
-        
-        # Provide helpful error messages
-        if "rate_limit" in error_msg.lower():
-            return "Error: Rate limit exceeded. Please wait a moment and try again.", []
-        elif "context_length" in error_msg.lower():
-            return "Error: Context too long. Try uploading smaller documents or asking a more specific question.", []
-        elif "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
-            return "Error: Authentication failed. Please check your Groq API key in the .env file.", []
-        else:
-            return f"Error generating response: {error_msg}", []
-    
-    # Extract unique sources
-    sources = list(set([doc_name for _, doc_name in top_chunks]))
-    logger.info(f"Sources: {', '.join(sources)}")
+        return describe_llm_error(model_name, e), [], meta
     
-    return answer, sources
+    if query_embedding is not None:
+        store_cached_response(query_embedding, query, top_chunks, answer, sources, meta["model"], temperature)
+    
+    return answer, sources, meta
 
 
 def get_model_info(model_name):
@@ -230,6 +762,11 @@ def list_available_models():
     return AVAILABLE_MODELS
 
 
+# Load persisted semantic cache and warm LLM clients on module import
+load_response_cache()
+warm_llm_cache()
+
+
 # Test response generation
 def test_response_generation():
     """
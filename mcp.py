@@ -13,17 +13,132 @@ Functions:
 
 """
 
+import time
 import logging
-from collections import defaultdict
+import itertools
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
 from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Module logger; handlers and level are configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
+# Fields every dict-form message must carry
+_REQUIRED_FIELDS = frozenset(("sender", "receiver", "payload"))
+
+
+@dataclass(slots=True)
+class MCPMessage:
+    """
+    Slotted MCP message; cheaper to build and route than a dict.
+    
+    Supports dict-style reads (message["payload"]) so receivers can treat
+    both message forms the same way.
+    """
+    sender: str
+    receiver: str
+    payload: dict = field(default_factory=dict)
+    timestamp: str = ""
+    message_id: str = ""
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+
+class ShardedQueues:
+    """
+    Per-receiver FIFO queues, safe to use from several threads.
+    
+    Receivers are spread over a fixed number of shards, each guarded by its
+    own lock, so agents exchanging messages concurrently rarely contend.
+    Iteration works on a snapshot taken shard by shard.
+    """
+    
+    def __init__(self, n_shards=16):
+        self._mask = n_shards - 1  # n_shards must be a power of two
+        self._shards = [defaultdict(deque) for _ in range(n_shards)]
+        self._locks = [threading.Lock() for _ in range(n_shards)]
+    
+    def _shard(self, receiver):
+        i = hash(receiver) & self._mask
+        return self._shards[i], self._locks[i]
+    
+    def append(self, receiver, message):
+        shard, lock = self._shard(receiver)
+        with lock:
+            shard[receiver].append(message)
+    
+    def popleft(self, receiver):
+        """
+        Remove and return the oldest message for receiver (None if empty).
+        """
+        shard, lock = self._shard(receiver)
+        with lock:
+            queue = shard.get(receiver)
+            return queue.popleft() if queue else None
+    
+    def pop_first(self, receiver, match):
+        """
+        Remove and return the oldest message for receiver that satisfies
+        match (None if there is none); other messages keep their order.
+        """
+        shard, lock = self._shard(receiver)
+        with lock:
+            queue = shard.get(receiver)
+            if not queue:
+                return None
+            for i, message in enumerate(queue):
+                if match(message):
+                    del queue[i]
+                    return message
+            return None
+    
+    def count(self, receiver):
+        shard, lock = self._shard(receiver)
+        with lock:
+            return len(shard.get(receiver, ()))
+    
+    def clear(self, receiver):
+        """
+        Drop all messages for receiver.
+        
+        Returns:
+            int: Number of messages removed, or None if receiver has no queue
+        """
+        shard, lock = self._shard(receiver)
+        with lock:
+            queue = shard.get(receiver)
+            if queue is None:
+                return None
+            count = len(queue)
+            queue.clear()
+            return count
+    
+    def snapshot(self):
+        """
+        Copy of every queue, taken under each shard's lock in turn.
+        
+        Returns:
+            dict: receiver -> list of queued messages
+        """
+        copy = {}
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                copy.update((receiver, list(queue)) for receiver, queue in shard.items())
+        return copy
+
+
 # Message queue storage (in-memory)
 # In production, this could be Redis, RabbitMQ, or other message broker
-message_queues = defaultdict(list)
+# deque gives O(1) appends and pops from the front of each FIFO queue
+message_queues = ShardedQueues()
+
+# Monotonic sequence number that keeps message IDs unique within a process
+_message_seq = itertools.count()
 
 
 def send_mcp_message(message):
@@ -42,32 +157,37 @@ def send_mcp_message(message):
     }
     
     Args:
-        message (dict): Message dictionary with sender, receiver, and payload
+        message (MCPMessage | dict): Message with sender, receiver, and payload
         
     Returns:
         bool: True if message sent successfully
     """
     try:
-        # Validate message structure
-        if not isinstance(message, dict):
-            logger.error("Message must be a dictionary")
-            return False
+        now_ns = time.time_ns()
+        timestamp = datetime.fromtimestamp(now_ns / 1e9).isoformat()
         
-        required_fields = ["sender", "receiver", "payload"]
-        for field in required_fields:
-            if field not in message:
-                logger.error(f"Message missing required field: {field}")
+        if isinstance(message, MCPMessage):
+            # Fields are guaranteed by the constructor
+            sender, receiver = message.sender, message.receiver
+            message.timestamp = timestamp
+            message.message_id = f"{sender}-{receiver}-{now_ns}-{next(_message_seq)}"
+        elif isinstance(message, dict):
+            # Validate message structure
+            missing = _REQUIRED_FIELDS - message.keys()
+            if missing:
+                logger.error(f"Message missing required field(s): {', '.join(sorted(missing))}")
                 return False
-        
-        # Add metadata
-        message["timestamp"] = datetime.now().isoformat()
-        message["message_id"] = f"{message['sender']}-{message['receiver']}-{datetime.now().timestamp()}"
+            sender, receiver = message["sender"], message["receiver"]
+            message["timestamp"] = timestamp
+            message["message_id"] = f"{sender}-{receiver}-{now_ns}-{next(_message_seq)}"
+        else:
+            logger.error("Message must be an MCPMessage or a dictionary")
+            return False
         
         # Route message to receiver's queue
-        receiver = message["receiver"]
-        message_queues[receiver].append(message)
+        message_queues.append(receiver, message)
         
-        logger.info(f"MCP Message sent: {message['sender']} → {message['receiver']}")
+        logger.info(f"MCP Message sent: {sender} → {receiver}")
         logger.debug(f"Message ID: {message['message_id']}")
         
         return True
@@ -77,19 +197,25 @@ def send_mcp_message(message):
         return False
 
 
-def receive_mcp_message(receiver_name):
+def receive_mcp_message(receiver_name, match=None):
     """
     Receive a message for a specific agent.
     
     Args:
         receiver_name (str): Name of the receiving agent
+        match (callable): Optional predicate; when given, the oldest message
+            it accepts is received instead of the oldest message overall
+            (lets concurrent callers each take their own reply)
         
     Returns:
-        dict: Message dictionary or None if no messages available
+        MCPMessage | dict: Message as sent, or None if no messages available
     """
     try:
-        if receiver_name in message_queues and message_queues[receiver_name]:
-            message = message_queues[receiver_name].pop(0)
+        if match is None:
+            message = message_queues.popleft(receiver_name)
+        else:
+            message = message_queues.pop_first(receiver_name, match)
+        if message is not None:
             logger.info(f"MCP Message received by {receiver_name} from {message['sender']}")
             return message
         else:
@@ -111,7 +237,7 @@ def peek_mcp_message(receiver_name):
     Returns:
         int: Number of messages in queue
     """
-    return len(message_queues.get(receiver_name, []))
+    return message_queues.count(receiver_name)
 
 
 def clear_mcp_queue(receiver_name):
@@ -121,9 +247,8 @@ def clear_mcp_queue(receiver_name):
     Args:
         receiver_name (str): Name of the receiving agent
     """
-    if receiver_name in message_queues:
-        count = len(message_queues[receiver_name])
-        message_queues[receiver_name].clear()
+    count = message_queues.clear(receiver_name)
+    if count is not None:
         logger.info(f"Cleared {count} messages from {receiver_name} queue")
 
 
@@ -134,12 +259,14 @@ def get_mcp_stats():
     Returns:
         dict: Statistics about message queues
     """
+    # Work on a snapshot so concurrent sends/receives can't break iteration
+    queues = message_queues.snapshot()
     stats = {
-        "total_queues": len(message_queues),
+        "total_queues": len(queues),
         "queues": {}
     }
     
-    for agent, messages in message_queues.items():
+    for agent, messages in queues.items():
         stats["queues"][agent] = {
             "message_count": len(messages),
             "latest_sender": messages[-1]["sender"] if messages else None
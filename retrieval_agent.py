@@ -3,7 +3,7 @@ Retrieval Agent - Vector Storage & Semantic Search Module
 =========================================================
 
 This agent handles:
-1. Creating embeddings from text chunks using SentenceTransformer
+1. Creating embeddings from text chunks using fastembed (ONNX Runtime)
 2. Storing embeddings in FAISS vector database
 3. Performing semantic search to retrieve relevant chunks
 4. Managing vector store persistence
@@ -12,114 +12,748 @@ This agent handles:
 """
 
 import os
+
+# Idle OpenMP threads sleep instead of spinning between bursty queries;
+# must be set before faiss loads the OpenMP runtime
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from fastembed import TextEmbedding
+import json
+import atexit
 import pickle
+import hashlib
 import logging
-from mcp import send_mcp_message
+import threading
+import time
+from array import array
+from itertools import repeat
+from collections import OrderedDict
+from mcp import MCPMessage, send_mcp_message
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Module logger; handlers and level are configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
 # Configuration
 VECTOR_STORE_PATH = "vector_store"
-EMBEDDINGS_FILE = os.path.join(VECTOR_STORE_PATH, "embeddings.pkl")
+CHUNKS_FILE = os.path.join(VECTOR_STORE_PATH, "chunks.jsonl")  # Append-only chunk log
 INDEX_FILE = os.path.join(VECTOR_STORE_PATH, "faiss_index.bin")
+INDEX_META_FILE = os.path.join(VECTOR_STORE_PATH, "index_meta.json")
+EMBEDDINGS_FILE = os.path.join(VECTOR_STORE_PATH, "embeddings.pkl")  # Legacy format, migrated on load
+INDEX_FLUSH_INTERVAL = 1000  # Vectors added between index writes
+EMBEDDING_BACKEND = "fastembed"  # Recorded in the index metadata; vectors from another backend are re-embedded
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384  # Dimension of all-MiniLM-L6-v2 embeddings
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))  # Texts per forward pass
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0)) or None  # ONNX Runtime intra-op threads (None = runtime default)
+
+# Embeddings are unit-length, so inner product equals cosine similarity
+INDEX_METRIC = faiss.METRIC_INNER_PRODUCT
+
+# Index layouts (FAISS factory strings). Small stores use an HNSW graph over
+# scalar-quantized vectors (fp16 by default, or 8-bit via HNSW_QUANTIZER=SQ8);
+# once there is enough data to train on, the store is rebuilt as an IVF-PQ
+# index with an HNSW coarse quantizer.
+HNSW_QUANTIZER = os.getenv("HNSW_QUANTIZER", "SQfp16")
+HNSW_FACTORY = f"HNSW32,{HNSW_QUANTIZER}"
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 16
+IVF_FACTORY = "OPQ32_64,IVF4096_HNSW32,PQ32"
+IVF_NLIST = 4096
+IVF_NPROBE = 16
+IVF_MIN_VECTORS = 30 * IVF_NLIST  # Training points needed for the IVF centroids
+QUERY_CACHE_SIZE = 4096  # Query embeddings kept in memory (LRU)
+
+# Below this many vectors a search is cheaper than waking extra threads
+SINGLE_THREAD_MAX_VECTORS = 10_000
+MAX_SEARCH_THREADS = 8
+
+class ChunkLog:
+    """
+    Chunk texts, kept on disk in the append-only chunk log.
+    
+    Only record boundaries (8 bytes per chunk) are held in memory; a chunk's
+    text is read back from the log when it is accessed, so memory use does
+    not grow with the corpus and the OS page cache serves repeated reads.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._bounds = array('Q', [0])  # Record i spans bytes [_bounds[i], _bounds[i + 1])
+        self._reader = None
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._bounds) - 1
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        
+        start, end = self._bounds[index], self._bounds[index + 1]
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, 'rb')
+            self._reader.seek(start)
+            record = self._reader.read(end - start)
+        return json.loads(record)['chunk']
+    
+    def scan(self):
+        """
+        Read the log once, recording boundaries and yielding each record.
+        
+        A partially written trailing record (from an interrupted append) is
+        truncated away once the scan is consumed, so later appends start on
+        a clean line.
+        
+        Yields:
+            dict: Parsed chunk log record
+        """
+        end = 0
+        with open(self.path, 'rb+') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                end += len(line)
+                self._bounds.append(end)
+                yield record
+            f.truncate(end)
+    
+    def append(self, lines):
+        """
+        Append encoded records; cost is independent of the log size.
+        
+        Args:
+            lines (list): Serialized records (bytes, newline-terminated)
+        """
+        with open(self.path, 'ab') as f:
+            f.write(b"".join(lines))
+        end = self._bounds[-1]
+        for line in lines:
+            end += len(line)
+            self._bounds.append(end)
+    
+    def truncate(self, n_chunks):
+        """
+        Drop every record after the first n_chunks.
+        """
+        del self._bounds[n_chunks + 1:]
+        with open(self.path, 'rb+') as f:
+            f.truncate(self._bounds[-1])
+    
+    def close(self):
+        """
+        Close the read handle (reopened on the next access).
+        """
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
 
-# Initialize embedding model (384-dimensional embeddings)
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-logger.info("Embedding model loaded: all-MiniLM-L6-v2 (384 dimensions)")
+# Embedding model (384-dimensional embeddings), loaded on first use
+_embedding_model = None
+_model_lock = threading.Lock()
+_encode_lock = threading.Lock()  # The ONNX session's tokenizer isn't safe to share across threads
 
 # Global variables for vector store
 vector_index = None
-stored_chunks = []
-document_mapping = []
+vector_index_factory = None  # Factory string the current index was built from
+_index_mmapped = False  # vector_index is a read-only memory map of INDEX_FILE
+stored_chunks = ChunkLog(CHUNKS_FILE)
+document_ids = array('I')  # Per-chunk document id (4 bytes per chunk)
+document_names = []  # Document id -> document name
+_document_id_lookup = {}  # Document name -> document id
+_seen = {}  # blake2b chunk digest -> chunk id, to skip re-embedding duplicates
+
+_search_threads = None  # Current faiss OpenMP thread count
+
+# GPU copy of the index used for search when faiss-gpu and a GPU are present.
+# vector_index stays the CPU master: it takes writes and is what gets saved.
+_gpu_resources = None
+_gpu_index = None
+_pending_index_adds = 0  # Vectors added since the index was last written
+
+# Serializes index/metadata updates when documents are ingested concurrently
+_store_lock = threading.Lock()
+
+# LRU cache of query embeddings keyed by (model name, query hash)
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """
+    Return the shared fastembed model, loading it on first use.
+    
+    Importing this module stays cheap; the ONNX model download and session
+    setup happen only when something is actually embedded. A one-off warmup
+    embed absorbs first-call overhead so the user's first query doesn't.
+    
+    Returns:
+        TextEmbedding: Loaded embedding model
+    """
+    global _embedding_model
+    
+    if _embedding_model is None:
+        with _model_lock:
+            if _embedding_model is None:
+                model = TextEmbedding(model_name=EMBEDDING_MODEL_NAME, threads=EMBEDDING_THREADS)
+                with _encode_lock:
+                    list(model.embed(["warmup"]))
+                _embedding_model = model
+                logger.info(f"Embedding model loaded: {EMBEDDING_MODEL_NAME} ({EMBEDDING_DIMENSION} dimensions)")
+    return _embedding_model
+
+
+def build_index(dimension, n_items, training_vectors=None):
+    """
+    Create an empty FAISS index suited to the corpus size.
+    
+    Below IVF_MIN_VECTORS the index is an HNSW graph over scalar-quantized
+    vectors (HNSW_QUANTIZER). Embeddings are unit-normalized, so every
+    component lies in [-1, 1]; an 8-bit quantizer is trained on that fixed
+    range rather than on sample data (fp16 needs no training). Larger
+    corpora get an IVF-PQ index trained on training_vectors.
+    
+    Args:
+        dimension (int): Embedding dimension
+        n_items (int): Number of vectors the index will hold
+        training_vectors (np.ndarray): Training data (required for IVF-PQ)
+        
+    Returns:
+        tuple: (index: trained, empty faiss.Index, factory: str)
+    """
+    if n_items < IVF_MIN_VECTORS or training_vectors is None:
+        factory = HNSW_FACTORY
+        index = faiss.index_factory(dimension, factory, INDEX_METRIC)
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.train(np.vstack([-np.ones(dimension), np.ones(dimension)]).astype('float32'))
+    else:
+        factory = IVF_FACTORY
+        index = faiss.index_factory(dimension, factory, INDEX_METRIC)
+        index.train(training_vectors)
+    
+    configure_search(index, factory)
+    return index, factory
+
+
+def configure_search(index, factory):
+    """
+    Apply query-time search parameters for the given index layout.
+    
+    Args:
+        index (faiss.Index): Index to configure
+        factory (str): Factory string the index was built from
+    """
+    params = faiss.ParameterSpace()
+    if factory == IVF_FACTORY:
+        params.set_index_parameter(index, "nprobe", IVF_NPROBE)
+    elif factory and factory.startswith("HNSW"):
+        # Any HNSW quantizer, including one a saved store was built with
+        params.set_index_parameter(index, "efSearch", HNSW_EF_SEARCH)
+
+
+def maybe_upgrade_index():
+    """
+    Rebuild the store as IVF-PQ once it holds enough vectors to train on.
+    
+    The stored vectors are reconstructed from the current index, used to
+    train the new one, and re-added in the same order so chunk ids are kept.
+    The rebuilt index is written to disk before returning.
+    
+    OPQ and IVF training run under the caller's _store_lock and can take
+    minutes on a large store; uploads wait for it (searches do not).
+    
+    Returns:
+        bool: True if the index was rebuilt and saved
+    """
+    global vector_index, vector_index_factory, _index_mmapped
+    
+    if vector_index_factory == IVF_FACTORY or vector_index.ntotal < IVF_MIN_VECTORS:
+        return False
+    
+    logger.warning(f"Rebuilding vector store as {IVF_FACTORY} ({vector_index.ntotal} vectors); "
+                   f"uploads are blocked until training finishes, which can take several minutes")
+    started = time.perf_counter()
+    vectors = vector_index.reconstruct_n(0, vector_index.ntotal)
+    index, factory = build_index(vectors.shape[1], len(vectors), training_vectors=vectors)
+    index.add(vectors)
+    vector_index, vector_index_factory = index, factory
+    _index_mmapped = False
+    sync_gpu_index()
+    save_vector_store()
+    logger.info(f"Rebuilt vector store in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+def sync_gpu_index():
+    """
+    Mirror the CPU index onto GPU 0 for searching, when possible.
+    
+    Only the IVF-PQ layout is cloned; faiss has no GPU HNSW, so small stores
+    (and hosts without faiss-gpu or a GPU) keep searching on the CPU.
+    """
+    global _gpu_resources, _gpu_index
+    
+    _gpu_index = None
+    if vector_index_factory != IVF_FACTORY:
+        return
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return
+    
+    try:
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        options = faiss.GpuClonerOptions()
+        options.useFloat16LookupTables = True  # Halves PQ lookup-table memory
+        _gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, 0, vector_index, options)
+        logger.info(f"Searching on GPU ({vector_index.ntotal} vectors)")
+    except Exception as e:
+        _gpu_index = None
+        logger.warning(f"Could not move index to GPU, searching on CPU: {str(e)}")
+
+
+def search_index():
+    """
+    Index to run searches against (the GPU copy if there is one).
+    """
+    return _gpu_index if _gpu_index is not None else vector_index
+
+
+def tune_search_threads():
+    """
+    Pin the faiss OpenMP thread count to the corpus size.
+    
+    Small stores search single-threaded (thread fan-out costs more than the
+    search itself); larger ones use up to MAX_SEARCH_THREADS cores.
+    """
+    global _search_threads
+    
+    n_vectors = vector_index.ntotal if vector_index is not None else 0
+    if n_vectors < SINGLE_THREAD_MAX_VECTORS:
+        threads = 1
+    else:
+        threads = min(os.cpu_count() or 1, MAX_SEARCH_THREADS)
+    
+    if threads != _search_threads:
+        faiss.omp_set_num_threads(threads)
+        _search_threads = threads
+        logger.info(f"FAISS search threads set to {threads} ({n_vectors} vectors)")
 
 
 def initialize_vector_store():
     """
     Initialize or load existing FAISS vector store.
     
+    The chunk log is scanned for metadata (chunk texts stay on disk) and an
+    IVF-PQ index is memory-mapped, so its inverted lists load on demand. The index is only
+    written periodically, so chunks logged after its last write are
+    re-embedded and added on load.
+    
     Creates:
     - FAISS index for similarity search
     - Storage for text chunks
     - Document metadata mapping
     """
-    global vector_index, stored_chunks, document_mapping
+    global vector_index, vector_index_factory, stored_chunks, document_ids, document_names, _document_id_lookup
+    global _seen, _index_mmapped
     
     os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
     
-    # Try to load existing vector store
-    if os.path.exists(INDEX_FILE) and os.path.exists(EMBEDDINGS_FILE):
+    vector_index = None
+    _index_mmapped = False
+    stored_chunks.close()
+    stored_chunks = ChunkLog(CHUNKS_FILE)
+    document_ids = array('I')
+    document_names = []
+    _document_id_lookup = {}
+    _seen = {}
+    
+    # Load stored chunks (converting a legacy pickle store first)
+    try:
+        if not os.path.exists(CHUNKS_FILE) and os.path.exists(EMBEDDINGS_FILE):
+            _migrate_pickle_store()
+        if os.path.exists(CHUNKS_FILE):
+            _load_chunk_log()
+    except Exception as e:
+        logger.warning(f"Could not load stored chunks: {str(e)}")
+        # Set the unreadable log aside so new chunks start a fresh one
+        stored_chunks.close()
+        if os.path.exists(CHUNKS_FILE):
+            os.replace(CHUNKS_FILE, CHUNKS_FILE + ".corrupt")
+        stored_chunks = ChunkLog(CHUNKS_FILE)
+        document_ids = array('I')
+        document_names = []
+        _document_id_lookup = {}
+        _seen = {}
+    
+    # Load the index written by the last flush
+    meta = _read_index_meta()
+    if stored_chunks and os.path.exists(INDEX_FILE) and not _same_embedding_model(meta):
+        # Vectors from another backend/model are not comparable with new
+        # query embeddings; leave vector_index unset so every chunk is
+        # re-embedded from the chunk log below
+        logger.warning(
+            f"Index was built with {meta.get('embedding_backend')}:{meta.get('embedding_model')}; "
+            f"re-embedding {len(stored_chunks)} chunks with {EMBEDDING_BACKEND}:{EMBEDDING_MODEL_NAME}"
+        )
+    elif stored_chunks and os.path.exists(INDEX_FILE):
         try:
-            vector_index = faiss.read_index(INDEX_FILE)
-            with open(EMBEDDINGS_FILE, 'rb') as f:
-                data = pickle.load(f)
-                stored_chunks = data['chunks']
-                document_mapping = data['documents']
-            logger.info(f"Loaded existing vector store: {len(stored_chunks)} chunks")
-            return
+            # IO_FLAG_MMAP only maps IVF inverted lists; other layouts are read
+            # into memory regardless, and mapping them would just make the
+            # first write read the file a second time
+            vector_index_factory = meta.get('index_factory')
+            _index_mmapped = vector_index_factory == IVF_FACTORY
+            vector_index = faiss.read_index(INDEX_FILE, faiss.IO_FLAG_MMAP if _index_mmapped else 0)
+            if vector_index.metric_type != INDEX_METRIC:
+                # Stores written before the switch to inner product are rebuilt
+                # from the chunk log: reconstructing their SQ/PQ codes would
+                # re-index lossy vectors and lose recall for good
+                logger.warning(f"Index uses L2 distance; re-embedding {len(stored_chunks)} chunks for inner-product search")
+                vector_index = None
+            elif vector_index.ntotal > len(stored_chunks):
+                logger.warning("Index holds more vectors than stored chunks; rebuilding")
+                vector_index = None
         except Exception as e:
-            logger.warning(f"Could not load existing vector store: {str(e)}")
+            logger.warning(f"Could not load existing index: {str(e)}")
+            vector_index = None
+    
+    if vector_index is None:
+        _index_mmapped = False
+        vector_index, vector_index_factory = build_index(EMBEDDING_DIMENSION, len(stored_chunks))
+        if not stored_chunks:
+            logger.info("Created new FAISS vector store")
+    
+    # Index chunks logged after the last index write
+    if vector_index.ntotal < len(stored_chunks):
+        _index_unflushed_chunks()
+    
+    configure_search(vector_index, vector_index_factory)
+    sync_gpu_index()
+    tune_search_threads()
+    if stored_chunks:
+        logger.info(f"Loaded existing vector store: {len(stored_chunks)} chunks")
+
+
+def _load_chunk_log():
+    """
+    Scan the chunk log for document ids and chunk digests.
+    """
+    for record in stored_chunks.scan():
+        digest = bytes.fromhex(record['hash']) if 'hash' in record else _chunk_digest(record['chunk'])
+        _seen.setdefault(digest, len(document_ids))
+        document_ids.append(_document_id(record['doc']))
+
+
+def _chunk_record(chunk, document_name, digest):
+    """
+    Serialize one chunk log line (the digest is stored so loads skip rehashing).
+    """
+    record = {"chunk": chunk, "doc": document_name, "hash": digest.hex()}
+    return json.dumps(record).encode('utf-8') + b"\n"
+
+
+def _chunk_digest(chunk):
+    """
+    128-bit blake2b digest identifying a chunk's text.
+    """
+    return hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+
+
+def _migrate_pickle_store():
+    """
+    Convert a store saved as a single pickle into the chunk log format.
+    """
+    with open(EMBEDDINGS_FILE, 'rb') as f:
+        data = pickle.load(f)
+    if 'documents' in data:
+        names = data['documents']
+    else:
+        names = [data['document_names'][i] for i in data['document_ids']]
+    
+    tmp_path = CHUNKS_FILE + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for chunk, name in zip(data['chunks'], names):
+            f.write(_chunk_record(chunk, name, _chunk_digest(chunk)))
+    os.replace(tmp_path, CHUNKS_FILE)
+    
+    if data.get('index_factory'):
+        _write_json(INDEX_META_FILE, {'index_factory': data['index_factory']})
+    os.remove(EMBEDDINGS_FILE)
+    logger.info("Migrated vector store metadata to the chunk log")
+
+
+def _index_unflushed_chunks():
+    """
+    Embed and index the chunks logged after the last index write.
+    
+    If they can't be embedded, they are dropped from memory and the log is
+    truncated so chunk ids stay aligned with index ids.
+    """
+    _make_index_writable()
+    start = vector_index.ntotal
+    logger.info(f"Indexing {len(stored_chunks) - start} chunks missing from the saved index")
+    embeddings = create_embeddings(stored_chunks[start:])
+    if embeddings is None:
+        logger.error("Could not embed unindexed chunks; dropping them")
+        stored_chunks.truncate(start)
+        del document_ids[start:]
+        for digest in [d for d, idx in _seen.items() if idx >= start]:
+            del _seen[digest]
+        return
+    
+    vector_index.add(embeddings)
+    if not maybe_upgrade_index():
+        save_vector_store()
+
+
+def _make_index_writable():
+    """
+    Replace a memory-mapped index with an in-memory copy before adding to it.
+    
+    Mapped IVF inverted lists are read-only, so the first write after a load
+    reads the index file fully; query-only sessions never pay for this.
+    """
+    global vector_index, _index_mmapped
     
-    # Create new vector store
-    dimension = 384  # Dimension of all-MiniLM-L6-v2 embeddings
-    vector_index = faiss.IndexFlatL2(dimension)
-    stored_chunks = []
-    document_mapping = []
-    logger.info("Created new FAISS vector store")
+    if not _index_mmapped:
+        return
+    vector_index = faiss.read_index(INDEX_FILE)
+    configure_search(vector_index, vector_index_factory)
+    _index_mmapped = False
+
+
+def _same_embedding_model(meta):
+    """
+    Check whether index metadata was written for the current embedding model.
+    
+    Stores saved before the metadata recorded the model (sentence-transformers
+    on PyTorch) count as a mismatch.
+    """
+    return (meta.get('embedding_backend'), meta.get('embedding_model')) == (EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME)
+
+
+def _index_meta():
+    """
+    Metadata saved next to the index: its layout and the model behind its vectors.
+    """
+    return {
+        'index_factory': vector_index_factory,
+        'embedding_backend': EMBEDDING_BACKEND,
+        'embedding_model': EMBEDDING_MODEL_NAME
+    }
+
+
+def _read_index_meta():
+    """
+    Read the index metadata file (empty dict if missing or unreadable).
+    """
+    if not os.path.exists(INDEX_META_FILE):
+        return {}
+    try:
+        with open(INDEX_META_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read index metadata: {str(e)}")
+        return {}
+
+
+def _write_json(path, data):
+    """
+    Write a JSON file via a temp file and atomic rename.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def ensure_vector_store():
+    """
+    Load or create the vector store on first use.
+    """
+    if vector_index is None:
+        with _store_lock:
+            if vector_index is None:
+                initialize_vector_store()
 
 
 def save_vector_store():
     """
-    Persist vector store to disk.
+    Write the FAISS index and its metadata to disk.
     
-    Saves:
-    - FAISS index (binary format)
-    - Text chunks and metadata (pickle format)
+    Chunks are persisted as they are added (see ChunkLog.append); only the
+    index is rewritten here, atomically via a temp file and rename.
     """
+    global _pending_index_adds
+    
     try:
-        faiss.write_index(vector_index, INDEX_FILE)
-        with open(EMBEDDINGS_FILE, 'wb') as f:
-            pickle.dump({
-                'chunks': stored_chunks,
-                'documents': document_mapping
-            }, f)
-        logger.info(f"Vector store saved: {len(stored_chunks)} chunks persisted")
+        tmp_path = INDEX_FILE + ".tmp"
+        faiss.write_index(vector_index, tmp_path)
+        os.replace(tmp_path, INDEX_FILE)
+        _write_json(INDEX_META_FILE, _index_meta())
+        _pending_index_adds = 0
+        logger.info(f"Vector store saved: {vector_index.ntotal} vectors indexed")
     except Exception as e:
         logger.error(f"Error saving vector store: {str(e)}")
 
 
+def _flush_on_exit():
+    """
+    Write vectors added since the last index flush before the process exits.
+    """
+    with _store_lock:
+        if vector_index is not None and _pending_index_adds:
+            save_vector_store()
+
+
+atexit.register(_flush_on_exit)
+
+
 def create_embeddings(texts):
     """
     Generate embeddings for a list of text chunks.
     
+    Texts are embedded shortest first so each batch pads to similar lengths,
+    and each vector is written straight into one preallocated float32
+    result in the caller's order.
+    
     Args:
         texts (list): List of text strings to embed
         
     Returns:
-        np.ndarray: Array of embeddings (shape: [n_texts, 384])
+        np.ndarray: Array of unit-length embeddings (shape: [n_texts, 384])
     """
     try:
-        embeddings = embedding_model.encode(texts, show_progress_bar=False)
-        logger.info(f"Created embeddings for {len(texts)} texts")
-        return np.array(embeddings).astype('float32')
+        model = get_embedding_model()
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+        with _encode_lock:
+            vectors = model.embed([texts[i] for i in order], batch_size=EMBEDDING_BATCH_SIZE)
+            for i, vector in zip(order, vectors):
+                embeddings[i] = vector
+        # Guarantee unit length for inner-product search
+        faiss.normalize_L2(embeddings)
+        logger.debug("Created embeddings for %d texts", len(texts))
+        return embeddings
     except Exception as e:
         logger.error(f"Error creating embeddings: {str(e)}")
         return None
 
 
+def embed_query(query):
+    """
+    Embed a single query, reusing the embedding of a previously seen query.
+    
+    Queries are normalized (stripped and lowercased; the MiniLM tokenizer is
+    uncased) and keyed by model name so a model swap never returns stale
+    vectors.
+    
+    Args:
+        query (str): User's question
+        
+    Returns:
+        numpy.ndarray: Read-only array of shape (1, dimension), or None on error
+    """
+    key = _query_cache_key(query)
+    
+    with _query_cache_lock:
+        embedding = _query_cache.get(key)
+        if embedding is not None:
+            _query_cache.move_to_end(key)
+            return embedding
+    
+    embedding = create_embeddings([query])
+    if embedding is None:
+        return None
+    _cache_query_embeddings([key], embedding)
+    return embedding
+
+
+def embed_queries(queries):
+    """
+    Embed several queries, encoding all cache misses in one batched call.
+    
+    Args:
+        queries (list): List of query strings
+        
+    Returns:
+        numpy.ndarray: Array of shape (len(queries), dimension), or None on error
+    """
+    keys = [_query_cache_key(query) for query in queries]
+    embeddings = np.empty((len(queries), EMBEDDING_DIMENSION), dtype=np.float32)
+    
+    missing = []
+    with _query_cache_lock:
+        for i, key in enumerate(keys):
+            cached = _query_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                _query_cache.move_to_end(key)
+                embeddings[i] = cached[0]
+    
+    if missing:
+        fresh = create_embeddings([queries[i] for i in missing])
+        if fresh is None:
+            return None
+        embeddings[missing] = fresh
+        _cache_query_embeddings([keys[i] for i in missing], fresh)
+    return embeddings
+
+
+def _query_cache_key(query):
+    """
+    Cache key for a query: (model name, sha256 of the normalized text).
+    """
+    digest = hashlib.sha256(query.strip().lower().encode('utf-8')).digest()
+    return (EMBEDDING_MODEL_NAME, digest)
+
+
+def _cache_query_embeddings(keys, embeddings):
+    """
+    Insert query embeddings into the LRU cache, evicting the oldest entries.
+    """
+    embeddings.setflags(write=False)  # Shared between callers
+    with _query_cache_lock:
+        for i, key in enumerate(keys):
+            _query_cache[key] = embeddings[i:i + 1]
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def _document_id(document_name):
+    """
+    Return the id for a document name, registering new names.
+    """
+    doc_id = _document_id_lookup.get(document_name)
+    if doc_id is None:
+        doc_id = len(document_names)
+        document_names.append(document_name)
+        _document_id_lookup[document_name] = doc_id
+    return doc_id
+
+
 def store_embeddings(chunks, document_name):
     """
     Store text chunks and their embeddings in vector database.
     
     Pipeline:
-    1. Generate embeddings for chunks
-    2. Add embeddings to FAISS index
-    3. Store text chunks with metadata
-    4. Persist to disk
+    1. Skip chunks whose text is already stored
+    2. Generate embeddings for the new chunks in batches
+    3. Add embeddings to FAISS index
+    4. Store text chunks with metadata
+    5. Persist to disk
     
     Args:
         chunks (list): List of text chunks
@@ -128,7 +762,7 @@ def store_embeddings(chunks, document_name):
     Returns:
         bool: True if successful, False otherwise
     """
-    global vector_index, stored_chunks, document_mapping
+    global vector_index, stored_chunks, document_ids, _pending_index_adds
     
     logger.info(f"Storing embeddings for document: {document_name}")
     
@@ -136,26 +770,62 @@ def store_embeddings(chunks, document_name):
         logger.warning("No chunks provided for storage")
         return False
     
-    # Initialize vector store if needed
-    if vector_index is None:
-        initialize_vector_store()
+    # Initialize vector store if needed (loads the digests of stored chunks)
+    ensure_vector_store()
     
-    # Create embeddings
+    # Drop chunks already in the store, and repeats within this batch
+    new_chunks = {}
+    for chunk in chunks:
+        digest = _chunk_digest(chunk)
+        if digest not in _seen and digest not in new_chunks:
+            new_chunks[digest] = chunk
+    if not new_chunks:
+        logger.info(f"All {len(chunks)} chunks from {document_name} are already stored")
+        return True
+    digests = list(new_chunks)
+    chunks = list(new_chunks.values())
+    
+    # Create embeddings for all new chunks in one batched call
     embeddings = create_embeddings(chunks)
     if embeddings is None:
         return False
     
     # Add to FAISS index
     try:
-        vector_index.add(embeddings)
-        
-        # Store chunks and metadata
-        for chunk in chunks:
-            stored_chunks.append(chunk)
-            document_mapping.append(document_name)
-        
-        # Persist to disk
-        save_vector_store()
+        with _store_lock:
+            # Another upload may have stored some of these chunks meanwhile
+            keep = [i for i, digest in enumerate(digests) if digest not in _seen]
+            if not keep:
+                return True
+            if len(keep) < len(digests):
+                digests = [digests[i] for i in keep]
+                chunks = [chunks[i] for i in keep]
+                embeddings = embeddings[keep]
+            
+            # Log chunks first: a crash before the next index flush only
+            # leaves chunks to re-embed on load, never orphaned vectors
+            stored_chunks.append([
+                _chunk_record(chunk, document_name, digest) for chunk, digest in zip(chunks, digests)
+            ])
+            
+            _make_index_writable()
+            vector_index.add(embeddings)
+            if _gpu_index is not None:
+                _gpu_index.add(embeddings)
+            
+            # Store chunks and metadata
+            _seen.update(zip(digests, range(len(document_ids), len(document_ids) + len(chunks))))
+            document_ids.extend(repeat(_document_id(document_name), len(chunks)))
+            
+            upgraded = maybe_upgrade_index()
+            tune_search_threads()
+            
+            # Write the index every INDEX_FLUSH_INTERVAL vectors (and at exit);
+            # a rebuild has just written everything, including this batch
+            if not upgraded:
+                _pending_index_adds += len(chunks)
+                if _pending_index_adds >= INDEX_FLUSH_INTERVAL:
+                    save_vector_store()
         
         logger.info(f"Successfully stored {len(chunks)} chunks from {document_name}")
         logger.info(f"Total chunks in vector store: {len(stored_chunks)}")
@@ -166,7 +836,7 @@ def store_embeddings(chunks, document_name):
         return False
 
 
-def retrieve_chunks(query, top_k=5):
+def retrieve_chunks(query, top_k=5, query_embedding=None):
     """
     Retrieve most relevant chunks for a query using semantic search.
     
@@ -179,17 +849,18 @@ def retrieve_chunks(query, top_k=5):
     Args:
         query (str): User's question
         top_k (int): Number of chunks to retrieve (default: 5)
+        query_embedding (np.ndarray): Precomputed, normalized query embedding;
+            skips embedding the query when given
         
     Returns:
         list: List of tuples (chunk_text, document_name)
     """
-    global vector_index, stored_chunks, document_mapping
+    global vector_index, stored_chunks, document_ids, document_names
     
-    logger.info(f"Retrieving chunks for query: '{query[:50]}...'")
+    logger.debug("Retrieving chunks for query: '%.50s...'", query)
     
     # Initialize vector store if needed
-    if vector_index is None:
-        initialize_vector_store()
+    ensure_vector_store()
     
     # Check if vector store is empty
     if len(stored_chunks) == 0:
@@ -197,48 +868,107 @@ def retrieve_chunks(query, top_k=5):
         return []
     
     try:
-        # Create query embedding
-        query_embedding = create_embeddings([query])
+        # Create query embedding (cached for repeated queries) unless supplied
         if query_embedding is None:
-            return []
+            query_embedding = embed_query(query)
+            if query_embedding is None:
+                return []
+        else:
+            query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, EMBEDDING_DIMENSION)
         
         # Search FAISS index
-        distances, indices = vector_index.search(query_embedding, min(top_k, len(stored_chunks)))
+        scores, indices = search_index().search(query_embedding, min(top_k, len(stored_chunks)))
         
-        # Retrieve chunks and metadata
-        results = []
-        for idx in indices[0]:
-            if idx < len(stored_chunks):  # Validity check
-                chunk = stored_chunks[idx]
-                doc_name = document_mapping[idx]
-                results.append((chunk, doc_name))
+        results = _collect_results(scores[0], indices[0])
+        _send_results(query, results)
+        return results
         
-        logger.info(f"Retrieved {len(results)} relevant chunks")
+    except Exception as e:
+        logger.error(f"Error retrieving chunks: {str(e)}")
+        return []
+
+
+def retrieve_chunks_batch(queries, top_k=5):
+    """
+    Retrieve relevant chunks for several queries with a single FAISS search.
+    
+    Query embeddings are stacked into one (B, dimension) matrix so the index
+    scores all queries in one call. Each query's results are sent to the
+    LLM Response Agent via MCP, in input order.
+    
+    Args:
+        queries (list): List of user questions
+        top_k (int): Number of chunks to retrieve per query (default: 5)
         
-        # Log similarity scores (lower L2 distance = more similar)
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            logger.info(f"  Rank {i+1}: Distance={dist:.4f}, Doc={document_mapping[idx]}")
+    Returns:
+        list: One list of (chunk_text, document_name) tuples per query
+    """
+    logger.debug("Retrieving chunks for %d queries", len(queries))
+    
+    ensure_vector_store()
+    
+    if not queries:
+        return []
+    if len(stored_chunks) == 0:
+        logger.warning("Vector store is empty - no documents indexed")
+        return [[] for _ in queries]
+    
+    try:
+        query_embeddings = embed_queries(queries)
+        if query_embeddings is None:
+            return [[] for _ in queries]
         
-        # Send results to LLM Response Agent via MCP
-        message = {
-            "sender": "RetrievalAgent",
-            "receiver": "LLMResponseAgent",
-            "payload": {
-                "query": query,
-                "top_chunks": results,
-                "metadata": {
-                    "num_results": len(results),
-                    "total_docs": len(set(document_mapping))
-                }
-            }
-        }
-        send_mcp_message(message)
+        scores, indices = search_index().search(query_embeddings, min(top_k, len(stored_chunks)))
         
-        return results
+        batch_results = []
+        for query, row_scores, row_indices in zip(queries, scores, indices):
+            results = _collect_results(row_scores, row_indices)
+            _send_results(query, results)
+            batch_results.append(results)
+        return batch_results
         
     except Exception as e:
         logger.error(f"Error retrieving chunks: {str(e)}")
-        return []
+        return [[] for _ in queries]
+
+
+def _collect_results(scores, indices):
+    """
+    Map one row of FAISS search output to (chunk_text, document_name) tuples.
+    """
+    # FAISS pads missing neighbours with -1; every other id is a stored chunk
+    hits = indices[indices >= 0].tolist()
+    results = [(stored_chunks[idx], document_names[document_ids[idx]]) for idx in hits]
+    
+    # Per-result logging is skipped entirely unless DEBUG is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Retrieved %d relevant chunks", len(results))
+        # Log similarity scores (higher cosine similarity = more similar)
+        for i, (score, idx) in enumerate(zip(scores, indices)):
+            if idx < 0:
+                continue
+            logger.debug("  Rank %d: Similarity=%.4f, Doc=%s", i + 1, score, document_names[document_ids[idx]])
+    
+    return results
+
+
+def _send_results(query, results):
+    """
+    Send retrieval results to the LLM Response Agent via MCP.
+    """
+    message = MCPMessage(
+        sender="RetrievalAgent",
+        receiver="LLMResponseAgent",
+        payload={
+            "query": query,
+            "top_chunks": results,
+            "metadata": {
+                "num_results": len(results),
+                "total_docs": len(document_names)
+            }
+        }
+    )
+    send_mcp_message(message)
 
 
 def get_vector_store_stats():
@@ -248,13 +978,13 @@ def get_vector_store_stats():
     Returns:
         dict: Statistics including chunk count, document count, etc.
     """
-    global stored_chunks, document_mapping
+    global stored_chunks, document_names
     
-    unique_docs = set(document_mapping)
+    ensure_vector_store()
     return {
         "total_chunks": len(stored_chunks),
-        "total_documents": len(unique_docs),
-        "documents": list(unique_docs),
+        "total_documents": len(document_names),
+        "documents": list(document_names),
         "index_size": vector_index.ntotal if vector_index else 0
     }
 
@@ -262,37 +992,45 @@ def get_vector_store_stats():
 def clear_vector_store():
     """
     Clear all data from vector store (useful for testing).
-    """
-    global vector_index, stored_chunks, document_mapping
     
-    dimension = 384
-    vector_index = faiss.IndexFlatL2(dimension)
-    stored_chunks = []
-    document_mapping = []
+    Runs under _store_lock so a concurrent store_embeddings cannot interleave
+    with the reset. The index (and its GPU copy) is emptied before the chunk
+    metadata, so an unlocked search never gets ids past the cleared chunks.
+    """
+    global vector_index, vector_index_factory, stored_chunks, document_ids, document_names, _document_id_lookup
+    global _pending_index_adds, _seen, _index_mmapped
     
-    # Remove files
-    if os.path.exists(INDEX_FILE):
-        os.remove(INDEX_FILE)
-    if os.path.exists(EMBEDDINGS_FILE):
-        os.remove(EMBEDDINGS_FILE)
+    with _store_lock:
+        vector_index, vector_index_factory = build_index(EMBEDDING_DIMENSION, 0)
+        _index_mmapped = False
+        sync_gpu_index()
+        stored_chunks.close()
+        stored_chunks = ChunkLog(CHUNKS_FILE)
+        document_ids = array('I')
+        document_names = []
+        _document_id_lookup = {}
+        tune_search_threads()
+        
+        _seen = {}
+        _pending_index_adds = 0
+        
+        # Remove files
+        for path in (CHUNKS_FILE, INDEX_FILE, INDEX_META_FILE, EMBEDDINGS_FILE):
+            if os.path.exists(path):
+                os.remove(path)
     
     logger.info("Vector store cleared")
 
-
-# Initialize on module import
-initialize_vector_store()
-
-
 if __name__ == "__main__":
     # Test the retrieval agent
     print("=" * 60)
     print("RETRIEVAL AGENT - Vector Storage & Semantic Search")
     print("=" * 60)
     print("\nKey Features:")
-    print("  ✓ SentenceTransformer embeddings (all-MiniLM-L6-v2)")
+    print("  ✓ fastembed (ONNX Runtime) embeddings (all-MiniLM-L6-v2)")
     print("  ✓ FAISS vector database for fast similarity search")
     print("  ✓ Persistent storage with automatic save/load")
-    print("  ✓ Semantic search with distance-based ranking")
+    print("  ✓ Semantic search with cosine-similarity ranking")
     print("\nVector Store Statistics:")
     stats = get_vector_store_stats()
     print(f"  - Total chunks: {stats['total_chunks']}")